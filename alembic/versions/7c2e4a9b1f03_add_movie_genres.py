@@ -0,0 +1,36 @@
+"""Add movie genres
+
+Revision ID: 7c2e4a9b1f03
+Revises: 4fb8b1c17212
+Create Date: 2026-10-18 10:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e4a9b1f03'
+down_revision: Union[str, None] = '4fb8b1c17212'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('movie_genres',
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ),
+    sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('movie_id', 'genre_id')
+    )
+    # Every movie's primary genre is the first one of its list
+    op.execute('INSERT INTO movie_genres (movie_id, genre_id, position) '
+               'SELECT id, genre_id, 0 FROM movies WHERE genre_id IS NOT NULL')
+
+
+def downgrade() -> None:
+    op.drop_table('movie_genres')
@@ -0,0 +1,34 @@
+"""Add rating and movie indexes
+
+Revision ID: b5d8f2c6e4a1
+Revises: 7c2e4a9b1f03
+Create Date: 2026-10-18 14:03:52.907316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d8f2c6e4a1'
+down_revision: Union[str, None] = '7c2e4a9b1f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the latest rating of every user and movie, so the unique index can be created
+    op.execute('DELETE FROM ratings WHERE user_id IS NOT NULL AND movie_id IS NOT NULL AND id NOT IN '
+               '(SELECT MAX(id) FROM ratings WHERE user_id IS NOT NULL AND movie_id IS NOT NULL '
+               'GROUP BY user_id, movie_id)')
+    op.create_index('ix_ratings_user_id_movie_id', 'ratings', ['user_id', 'movie_id'], unique=True)
+    op.create_index(op.f('ix_ratings_movie_id'), 'ratings', ['movie_id'], unique=False)
+    op.create_index(op.f('ix_movies_genre_id'), 'movies', ['genre_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_movies_genre_id'), table_name='movies')
+    op.drop_index(op.f('ix_ratings_movie_id'), table_name='ratings')
+    op.drop_index('ix_ratings_user_id_movie_id', table_name='ratings')
@@ -1,33 +1,8 @@
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from sqlalchemy.orm import Session
-from models.base import Rating, Movie
-from database import get_db
-
-
-def load_data_from_db():
-    db: Session = next(get_db())
-
-    ratings_query = db.query(Rating).all()
-    ratings_data = pd.DataFrame([
-        {'user_id': rating.user_id, 'movie_id': rating.movie_id, 'rating': rating.rating}
-        for rating in ratings_query
-    ])
-
-    movies_query = db.query(Movie).all()
-    movies_data = pd.DataFrame([
-        {
-            'movie_id': movie.id,
-            'runtime': movie.runtime,
-            'release_date': movie.release_date.strftime('%Y-%m-%d'),
-            'title': movie.title,
-            'genre': movie.genre
-        }
-        for movie in movies_query
-    ])
-
-    return ratings_data, movies_data
+from algorithm.features import MovieFeatures, MISSING
+from algorithm.scoring import user_preferences, score_candidates, rank_candidates
 
 
 def build_user_item_matrix(ratings_data):
@@ -97,16 +72,19 @@ def predict_rating(user_id, movie_id, similarity_matrix, user_item_matrix, movie
 
 
 def recommend_movies(user_id, user_item_matrix, similarity_matrix, movies_data, k=2, top_n=3):
-    user_ratings = user_item_matrix.loc[user_id]
+    user_index = user_item_matrix.index.get_loc(user_id)
+    user_ratings = user_item_matrix.iloc[user_index]
+    rated_movies = user_ratings[user_ratings.notna()]
+    features = MovieFeatures.from_dataframe(movies_data)
     unrated_movies = user_ratings[user_ratings.isna()].index
+    unrated_movies = unrated_movies[features.rows(unrated_movies) != MISSING]
 
-    predictions = []
-    for movie_id in unrated_movies:
-        predicted_rating = predict_rating(user_id, movie_id, similarity_matrix, user_item_matrix, movies_data, k)
-        if predicted_rating is not None:
-            predictions.append((movie_id, predicted_rating))
+    top_k_users = np.argsort(similarity_matrix[user_index])[-k:]
+    neighbour_ratings = user_item_matrix.iloc[top_k_users][unrated_movies].to_numpy(dtype=np.float64)
 
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    recommended_movies = [movies_data.loc[movies_data['movie_id'] == movie_id, 'title'].iloc[0] for movie_id, _ in predictions[:top_n]]
+    preferences = user_preferences(rated_movies.to_numpy(), *features.scoring_features(features.rows(rated_movies.index)))
+    scores = score_candidates(neighbour_ratings, similarity_matrix[user_index, top_k_users],
+                              *features.scoring_features(features.rows(unrated_movies)), preferences)
 
-    return recommended_movies
\ No newline at end of file
+    recommended_ids = rank_candidates(unrated_movies.to_numpy(), scores, top_n)
+    return features.titles[features.rows(recommended_ids)].tolist()
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of cached recommendation lists, 0 disables the cache
+CACHE_SIZE = int(os.getenv("RECOMMENDER_CACHE_SIZE", "10000"))
+# Seconds a cached recommendation list stays valid, 0 keeps it until it is evicted or invalidated
+CACHE_TTL = float(os.getenv("RECOMMENDER_CACHE_TTL", "300"))
+
+
+class RecommendationCache:
+    """
+    Bounded LRU cache of final recommendation lists, keyed by (user_id, k, top_n, model version,
+    filters).
+    Entries expire after a TTL, and all entries of a user are dropped when a rating change may
+    have changed the user's recommendations.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        # Incremented on every invalidation, so results computed before it aren't stored after it
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, user_id, k, top_n, version, filters=()):
+        """
+        Returns a cached recommendation list and marks it as recently used.
+        :return: The list, or None when it isn't cached or has expired.
+        """
+        key = (user_id, k, top_n, version, filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and entry[1] <= time.monotonic():
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, user_id, k, top_n, version, recommendations, generation=None, filters=()):
+        """
+        Caches a recommendation list, evicting the least recently used lists beyond max_size.
+        :param generation: The generation read before the list was computed. The list isn't
+            cached if an invalidation happened since then, as it may already be outdated.
+        :param filters: Hashable description of any other parameters the list depends on.
+        """
+        if self.max_size <= 0:
+            return
+
+        key = (user_id, k, top_n, version, filters)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+            self._entries[key] = (list(recommendations), expires_at)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_users(self, user_ids):
+        """
+        Drops every cached list of the given users.
+        """
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                keys = self._keys_by_user.pop(user_id, ())
+                for key in keys:
+                    del self._entries[key]
+                self.invalidations += len(keys)
+
+    def clear(self):
+        """
+        Drops all cached lists, e.g. after the model was swapped.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys_by_user[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_user[key[0]]
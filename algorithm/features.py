@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from algorithm.scoring import NO_GENRE
+
+# Stored for runtimes and release years that are unknown
+MISSING = -1
+
+
+class MovieFeatures:
+    """
+    Columnar store of the movie features used by the recommender: one compact array per
+    feature and a movie id to row index map, so every lookup is a plain array index.
+    The release dates and IMDB ids are only stored to describe recommended movies.
+    """
+
+    def __init__(self, movie_ids, titles, release_years, runtimes, genres, release_dates=None, imdb_ids=None):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.titles = np.asarray(titles, dtype=object)
+        self.release_years = np.asarray(release_years, dtype=np.int16)
+        self.runtimes = np.clip(np.asarray(runtimes, dtype=np.int64), MISSING, np.iinfo(np.int16).max).astype(np.int16)
+        # Genre ids when loaded from the database
+        self.genres = np.asarray(genres, dtype=np.int32)
+        if release_dates is None:
+            release_dates = np.full(len(self.movie_ids), np.datetime64('NaT'))
+        self.release_dates = np.asarray(release_dates, dtype='datetime64[D]')
+        if imdb_ids is None:
+            imdb_ids = np.full(len(self.movie_ids), None)
+        self.imdb_ids = np.asarray(imdb_ids, dtype=object)
+        self.index = {int(movie_id): row for row, movie_id in enumerate(self.movie_ids)}
+
+    @classmethod
+    def from_dataframe(cls, movies_data):
+        """
+        Builds the store from a DataFrame with movie_id, title, release_date, runtime and genre
+        columns, where the genre is the genre id of the movie, like in the database.
+        :return: A new MovieFeatures.
+        """
+        release_dates = pd.to_datetime(movies_data['release_date'], errors='coerce')
+        runtimes = pd.to_numeric(movies_data['runtime'], errors='coerce')
+        genres = pd.to_numeric(movies_data['genre'], errors='coerce').fillna(NO_GENRE)
+        # Copied, because the store is updated in place
+        return cls(
+            movies_data['movie_id'].to_numpy(copy=True),
+            movies_data['title'].to_numpy(copy=True),
+            release_dates.dt.year.fillna(MISSING).to_numpy(),
+            runtimes.fillna(MISSING).to_numpy(),
+            genres.to_numpy(),
+            release_dates.to_numpy(dtype='datetime64[D]'),
+        )
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def rows(self, movie_ids):
+        """
+        Returns the row index of every given movie, MISSING for unknown movies.
+        """
+        return np.fromiter((self.index.get(int(movie_id), MISSING) for movie_id in movie_ids),
+                           dtype=np.int64, count=len(movie_ids))
+
+    def set_movie(self, movie_id, title, release_date, runtime, genre_id, imdb_id=None):
+        """
+        Stores the features of a created or updated movie in place, appending a row for a movie
+        the store doesn't know yet.
+        :param release_date: A date, or None when unknown.
+        :param genre_id: The genre code, or None when unknown.
+        :return: The row index of the movie.
+        """
+        values = {
+            "titles": title,
+            "release_years": MISSING if release_date is None else release_date.year,
+            "runtimes": MISSING if runtime is None else min(runtime, np.iinfo(np.int16).max),
+            "genres": NO_GENRE if genre_id is None else genre_id,
+            "release_dates": np.datetime64('NaT') if release_date is None else np.datetime64(release_date, 'D'),
+            "imdb_ids": imdb_id,
+        }
+        row = self.index.get(int(movie_id))
+        if row is None:
+            row = self.index[int(movie_id)] = len(self.movie_ids)
+            self.movie_ids = np.append(self.movie_ids, movie_id)
+            for name, value in values.items():
+                column = getattr(self, name)
+                setattr(self, name, np.append(column, np.array([value], dtype=column.dtype)))
+        else:
+            for name, value in values.items():
+                getattr(self, name)[row] = value
+        return row
+
+    def remove_movie(self, movie_id):
+        """
+        Forgets a deleted movie, so lookups of its id return MISSING. Its row is kept, because
+        the rows of the other movies must not move.
+        """
+        self.index.pop(int(movie_id), None)
+
+    def describe(self, rows):
+        """
+        Returns the movies at the given rows in the shape of a MovieDto.
+        :return: A list of dicts.
+        """
+        return [
+            {
+                "id": int(self.movie_ids[row]),
+                "title": self.titles[row],
+                "release_date": None if np.isnat(self.release_dates[row]) else self.release_dates[row].item(),
+                "runtime": None if self.runtimes[row] == MISSING else int(self.runtimes[row]),
+                "imdb_id": self.imdb_ids[row],
+                "genre_id": None if self.genres[row] == NO_GENRE else int(self.genres[row]),
+            }
+            for row in rows
+        ]
+
+    def scoring_features(self, rows):
+        """
+        Returns the runtimes and release years as floats with NaN for missing values, and the
+        genre codes, of the given rows. Rows that are MISSING have no features at all.
+        :return: A tuple (runtimes, release_years, genres).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(self):
+            return np.full(len(rows), np.nan), np.full(len(rows), np.nan), np.full(len(rows), NO_GENRE)
+
+        known = rows != MISSING
+        runtimes = np.where(known, self.runtimes[rows], MISSING).astype(np.float64)
+        release_years = np.where(known, self.release_years[rows], MISSING).astype(np.float64)
+        runtimes[runtimes == MISSING] = np.nan
+        release_years[release_years == MISSING] = np.nan
+        genres = np.where(known, self.genres[rows], NO_GENRE).astype(np.int64)
+        return runtimes, release_years, genres
@@ -0,0 +1,149 @@
+import os
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+# Ranked candidate movies computed per user on every refill
+FEED_QUEUE_DEPTH = int(os.getenv("FEED_QUEUE_DEPTH", "50"))
+# A queue is refilled in the background when fewer candidates than this are left
+FEED_REFILL_THRESHOLD = int(os.getenv("FEED_REFILL_THRESHOLD", "10"))
+# Maximum number of users with a queue in memory, the least recently used queues are dropped beyond it
+FEED_MAX_USERS = int(os.getenv("FEED_MAX_USERS", "10000"))
+# Number of similar users the feed candidates are ranked from
+FEED_NEIGHBOURS = int(os.getenv("FEED_NEIGHBOURS", "5"))
+
+
+class _Queue:
+    def __init__(self):
+        # Candidates by movie id, best first
+        self.cards = OrderedDict()
+        self.filled = False
+        self.refilling = False
+        # Whether movies were consumed since the last refill, which may have made new candidates available
+        self.stale = False
+        # Movies consumed while a refill is running, which the refill may still return
+        self.consumed = set()
+
+
+class FeedQueues:
+    """
+    Bounded LRU store of per-user queues of ranked candidate movies, so the next cards of a
+    user's feed are served without computing recommendations.
+    Movies are removed from a queue as the user rates them, and a queue is refilled from the
+    recommender when it runs low. Memory is bounded by max_users queues of depth candidates.
+    """
+
+    def __init__(self, depth=FEED_QUEUE_DEPTH, refill_threshold=FEED_REFILL_THRESHOLD, max_users=FEED_MAX_USERS):
+        self.depth = depth
+        self.refill_threshold = refill_threshold
+        self.max_users = max_users
+        self.refills = 0
+        self.evictions = 0
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._queues)
+
+    def peek(self, user_id, n):
+        """
+        Returns the next cards of a user's feed without removing them, and marks the queue as
+        recently used.
+        :return: A list of up to n cards, or None when the user's queue hasn't been filled yet.
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None or not queue.filled:
+                return None
+            self._queues.move_to_end(user_id)
+            return list(islice(queue.cards.values(), n))
+
+    def needs_refill(self, user_id):
+        """
+        Whether a user's queue should be refilled: it is missing, or it has fewer candidates than
+        the refill threshold and movies were consumed since the last refill, and no refill is running.
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                return True
+            if queue.refilling:
+                return False
+            return not queue.filled or (len(queue.cards) < self.refill_threshold and queue.stale)
+
+    def start_refill(self, user_id):
+        """
+        Marks the refill of a user's queue as running, creating the queue if needed.
+        :return: False if a refill of the queue is already running.
+        """
+        if self.max_users <= 0:
+            return False
+
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = _Queue()
+                while len(self._queues) > self.max_users:
+                    self._queues.popitem(last=False)
+                    self.evictions += 1
+            self._queues.move_to_end(user_id)
+            if queue.refilling:
+                return False
+            queue.refilling = True
+            queue.consumed = set()
+            return True
+
+    def finish_refill(self, user_id, cards):
+        """
+        Replaces the candidates of a user's queue with a newly ranked list.
+        :param cards: Dicts with an id, best first, of which the first depth are kept.
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                # Evicted while the refill was running
+                return
+            queue.cards = OrderedDict((card["id"], card) for card in cards[:self.depth]
+                                      if card["id"] not in queue.consumed)
+            queue.filled = True
+            queue.refilling = False
+            queue.stale = False
+            queue.consumed = set()
+            self.refills += 1
+
+    def abort_refill(self, user_id):
+        """
+        Marks the refill of a user's queue as no longer running, e.g. after it failed.
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is not None:
+                queue.refilling = False
+
+    def consume(self, user_id, movie_ids):
+        """
+        Removes movies the user rated from the user's queue.
+        """
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                return
+            for movie_id in movie_ids:
+                queue.cards.pop(movie_id, None)
+                if queue.refilling:
+                    queue.consumed.add(movie_id)
+            queue.stale = True
+
+    def drop(self, user_id):
+        """
+        Drops the queue of a single user, e.g. after the user was deleted.
+        """
+        with self._lock:
+            self._queues.pop(user_id, None)
+
+    def clear(self):
+        """
+        Drops all queues, e.g. after the database contents were replaced.
+        """
+        with self._lock:
+            self._queues.clear()
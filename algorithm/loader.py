@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+from sqlalchemy import select, func, extract, cast, Integer
+
+from algorithm.features import MovieFeatures, MISSING
+from algorithm.scoring import NO_GENRE
+from models.base import Rating, Movie
+
+# Rows fetched per round trip; on Postgres the rows are streamed from a server-side cursor
+LOAD_CHUNK_SIZE = int(os.getenv("RECOMMENDER_LOAD_CHUNK_SIZE", "10000"))
+
+
+def load_ratings(db, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Streams the user id, movie id and rating columns of all ratings into arrays.
+    :return: A tuple of arrays (user_ids, movie_ids, ratings).
+    """
+    statement = (select(Rating.user_id, Rating.movie_id, Rating.rating)
+                 .where(Rating.user_id.is_not(None), Rating.movie_id.is_not(None)))
+    return load_columns(db, statement, [np.int64, np.int64, np.float32], chunk_size)
+
+
+def load_movie_features(db, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Streams the columns of the movies table that the recommender uses into a MovieFeatures store.
+    Release years are extracted and missing values replaced by the database, and genre ids are
+    used as genre codes.
+    :return: A new MovieFeatures.
+    """
+    statement = select(
+        Movie.id,
+        Movie.title,
+        func.coalesce(cast(extract('year', Movie.release_date), Integer), MISSING),
+        func.coalesce(Movie.runtime, MISSING),
+        func.coalesce(Movie.genre_id, NO_GENRE),
+        Movie.release_date,
+        Movie.imdb_id,
+    ).order_by(Movie.id)
+    dtypes = [np.int64, object, np.int16, np.int64, np.int32, 'datetime64[D]', object]
+    columns = load_columns(db, statement, dtypes, chunk_size)
+    return MovieFeatures(*columns)
+
+
+def load_columns(db, statement, dtypes, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Executes a select statement and copies its result, chunk by chunk, into one preallocated
+    array per selected column. Only the current chunk of rows is held in memory as Python objects.
+    :param dtypes: The NumPy dtype of every selected column.
+    :return: A list with one array per column.
+    """
+    capacity = db.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar_one()
+    columns = [np.empty(capacity, dtype=dtype) for dtype in dtypes]
+    filled = 0
+
+    result = db.execute(statement.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        if filled + len(rows) > capacity:
+            # Rows were inserted after counting them
+            capacity = max(filled + len(rows), capacity * 2)
+            columns = [np.resize(column, capacity) for column in columns]
+
+        for column, values in zip(columns, zip(*rows)):
+            column[filled:filled + len(rows)] = values
+        filled += len(rows)
+
+    return [column[:filled] for column in columns]
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+
+LSH_TABLES = int(os.getenv("RECOMMENDER_LSH_TABLES", "16"))
+# Hyperplanes per table; 0 picks a number that gives buckets of about LSH_BUCKET_SIZE users
+LSH_BITS = int(os.getenv("RECOMMENDER_LSH_BITS", "0"))
+LSH_BUCKET_SIZE = 16
+LSH_SEED = 42
+
+
+class LshNeighbourIndex:
+    """
+    Approximate top-k neighbour index using random hyperplane (SimHash) locality
+    sensitive hashing. Every table hashes a user's ratings to the signs of a few random
+    projections, so users with a similar rating direction tend to share a bucket.
+    Candidates from the user's buckets, and the buckets one bit away, are then ranked
+    by their exact cosine similarity. The users x users similarity matrix is never built.
+    """
+
+    def __init__(self, matrix, norms, tables=LSH_TABLES, bits=LSH_BITS, seed=LSH_SEED, planes=None, keys=None):
+        n_users = matrix.shape[0]
+        self.tables = tables
+        self.bits = bits or max(1, int(np.log2(max(n_users, 1) / LSH_BUCKET_SIZE)))
+        self.seed = seed
+        self._planes = planes if planes is not None else self._random_planes(matrix.movie_ids)
+        self._powers = 1 << np.arange(self.bits, dtype=np.int64)
+
+        self._matrix = matrix
+        self._norms = norms
+        self._buckets = [{} for _ in range(self.tables)]
+
+        if keys is None:
+            keys = np.zeros((n_users, self.tables), dtype=np.int64)
+            for table in range(self.tables):
+                projections = matrix.dot(self._table_planes(table))
+                keys[:, table] = (projections > 0) @ self._powers
+        self._keys = keys
+        for user_index in np.flatnonzero(norms > 0):
+            self._insert(user_index)
+
+    @classmethod
+    def from_arrays(cls, matrix, norms, arrays, seed=LSH_SEED):
+        """
+        Restores an index from the arrays returned by to_arrays(). Only the buckets are
+        rebuilt from the stored keys, no ratings are projected again.
+        :return: A new LshNeighbourIndex.
+        """
+        planes, keys = arrays["planes"], arrays["keys"]
+        tables = keys.shape[1]
+        return cls(matrix, norms, tables, planes.shape[1] // tables, seed, planes=planes, keys=keys)
+
+    def to_arrays(self):
+        """
+        Returns the arrays that from_arrays() needs to restore the index.
+        """
+        return {"planes": self._planes, "keys": self._keys}
+
+    def neighbours(self, user_index, k):
+        """
+        Returns approximately the k most similar users of a user, most similar first.
+        Fewer than k users are returned when the buckets hold fewer candidates.
+        :return: A tuple (user_indexes, similarities).
+        """
+        candidates = self._candidates(user_index)
+        if self._norms[user_index] == 0 or not len(candidates) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        columns, ratings = self._matrix.row(user_index)
+        user_ratings = np.zeros(self._matrix.shape[1])
+        user_ratings[columns] = ratings
+
+        denominators = self._norms[candidates] * self._norms[user_index]
+        similarities = np.divide(self._matrix.row_dots(candidates, user_ratings), denominators,
+                                 out=np.zeros(len(candidates)), where=denominators > 0)
+
+        if k < len(candidates):
+            selected = np.argpartition(similarities, -k)[-k:]
+        else:
+            selected = np.arange(len(candidates))
+        selected = selected[np.argsort(-similarities[selected], kind='stable')]
+        return candidates[selected], similarities[selected]
+
+    def add_user(self):
+        """
+        Adds a user without ratings to the index. Such users are not hashed into any bucket.
+        """
+        self._keys = np.vstack([self._keys, np.zeros((1, self.tables), dtype=np.int64)])
+
+    def tracks(self, k):
+        """
+        Whether update_user() reports every user whose k nearest neighbours may change.
+        """
+        return True
+
+    def update_user(self, matrix, norms, user_index):
+        """
+        Rehashes a single user after a rating change.
+        :return: The indexes of the users that are candidates of the user before or after the
+            change, including the user itself, as their neighbours may have changed.
+        """
+        self._matrix = matrix
+        self._norms = norms
+        if matrix.shape[1] > len(self._planes):
+            self._planes = np.vstack([self._planes, self._random_planes(matrix.movie_ids[len(self._planes):])])
+
+        affected = [self._candidates(user_index), [user_index]]
+        self._remove(user_index)
+        if norms[user_index] == 0:
+            return np.unique(np.concatenate(affected))
+
+        columns, ratings = matrix.row(user_index)
+        projections = ratings.astype(np.float64) @ self._planes[columns]
+        for table in range(self.tables):
+            table_projections = projections[table * self.bits:(table + 1) * self.bits]
+            self._keys[user_index, table] = (table_projections > 0) @ self._powers
+        self._insert(user_index)
+        affected.append(self._candidates(user_index))
+        return np.unique(np.concatenate(affected))
+
+    def _random_planes(self, movie_ids):
+        """
+        Random signs work as well as gaussian hyperplanes for SimHash, at an eighth of the memory.
+        The signs of a movie are a hash of the seed and the movie id instead of the next numbers
+        of a random generator, so movies added after a restore from a snapshot, and the same
+        movie in another build, get the same signs.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.uint64)
+        planes = np.arange(self.tables * self.bits, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            hashes = (movie_ids[:, None] * np.uint64(0x9E3779B97F4A7C15)
+                      + planes[None, :] * np.uint64(0xBF58476D1CE4E5B9) + np.uint64(self.seed))
+            # Finalizer of splitmix64, so every bit of the hash depends on every bit of the input
+            hashes ^= hashes >> np.uint64(30)
+            hashes *= np.uint64(0xBF58476D1CE4E5B9)
+            hashes ^= hashes >> np.uint64(27)
+            hashes *= np.uint64(0x94D049BB133111EB)
+            hashes ^= hashes >> np.uint64(31)
+        return np.where(hashes >> np.uint64(63), 1, -1).astype(np.int8)
+
+    def _table_planes(self, table):
+        return self._planes[:, table * self.bits:(table + 1) * self.bits]
+
+    def _insert(self, user_index):
+        for table, key in enumerate(self._keys[user_index]):
+            self._buckets[table].setdefault(int(key), set()).add(int(user_index))
+
+    def _remove(self, user_index):
+        for table, key in enumerate(self._keys[user_index]):
+            bucket = self._buckets[table].get(int(key))
+            if bucket is not None:
+                bucket.discard(int(user_index))
+
+    def _candidates(self, user_index):
+        """
+        Collects the users sharing a bucket with the user in any table, probing the buckets
+        that differ in one bit as well.
+        """
+        candidates = set()
+        for table, key in enumerate(self._keys[user_index]):
+            buckets = self._buckets[table]
+            for probe in (0, *self._powers):
+                candidates.update(buckets.get(int(key) ^ int(probe), ()))
+        candidates.discard(int(user_index))
+        return np.fromiter(candidates, dtype=np.int64, count=len(candidates))
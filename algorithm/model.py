@@ -0,0 +1,349 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from algorithm.features import MovieFeatures, MISSING
+from algorithm.neighbours import create_neighbour_index
+from algorithm.profiles import UserProfiles
+from algorithm.scoring import score_candidates, top_candidates
+from algorithm.sparse import RatingMatrix, BLOCK_ELEMENTS
+
+
+class RecommenderModel:
+    """
+    In-memory recommender state, built once from the ratings and movies and then
+    reused for every recommendation request.
+    """
+
+    def __init__(self, matrix, features, neighbour_index=None, profiles=None):
+        """
+        :param neighbour_index: A restored neighbour index, built from the matrix when omitted.
+        :param profiles: Restored user profiles, built from the matrix when omitted.
+        """
+        self.matrix = matrix
+        self.features = features
+        # Feature store row of every matrix column, MISSING for movies the store doesn't know
+        self.column_rows = features.rows(matrix.movie_ids)
+        self.norms = matrix.row_norms()
+        if neighbour_index is None:
+            neighbour_index = create_neighbour_index(matrix, self.norms)
+        self.neighbour_index = neighbour_index
+        if profiles is None:
+            profiles = UserProfiles.build(matrix, *features.scoring_features(self.column_rows))
+        self.profiles = profiles
+        self.built_at = time.time()
+        self.version = 0
+        self.build_duration = 0.0
+        # Guards the matrices, so readers never see a half-applied rating update
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, ratings_data, movies_data):
+        """
+        Builds a model from DataFrames.
+        :param ratings_data: DataFrame with user_id, movie_id and rating columns.
+        :param movies_data: DataFrame with movie_id, title, release_date, runtime and genre columns.
+        :return: A new RecommenderModel.
+        """
+        if ratings_data.empty:
+            ratings_data = pd.DataFrame(columns=['user_id', 'movie_id', 'rating'])
+        if movies_data.empty:
+            movies_data = pd.DataFrame(columns=['movie_id', 'runtime', 'release_date', 'title', 'genre'])
+
+        matrix = RatingMatrix.from_ratings(
+            ratings_data['user_id'].to_numpy(), ratings_data['movie_id'].to_numpy(), ratings_data['rating'].to_numpy()
+        )
+        return cls(matrix, MovieFeatures.from_dataframe(movies_data))
+
+    @property
+    def user_index(self):
+        return self.matrix.user_index
+
+    @property
+    def movie_index(self):
+        return self.matrix.movie_index
+
+    def neighbours(self, user_id, k=5):
+        """
+        Returns the k users most similar to a user, most similar first.
+        :return: A list of (user_id, similarity) tuples.
+        """
+        with self.lock:
+            if user_id not in self.user_index:
+                return []
+            indexes, similarities = self.neighbour_index.neighbours(self.user_index[user_id], k)
+            return [(int(self.matrix.user_ids[index]), float(similarity))
+                    for index, similarity in zip(indexes, similarities)]
+
+    def tracks_changes(self, k):
+        """
+        Whether apply_rating() and remove_rating() report every user whose recommendations
+        from k neighbours may change, so those recommendations can be cached.
+        """
+        return self.neighbour_index.tracks(k)
+
+    def recommend(self, user_id, k=2, top_n=3):
+        """
+        Recommends movies for a user from the precomputed matrices.
+        Users without any ratings are not part of the model and get no recommendations.
+        :return: A list of recommended movie titles.
+        """
+        with self.lock:
+            rows, _ = self._rank(user_id, k, top_n)
+            return self.features.titles[rows].tolist()
+
+    def recommend_movies(self, user_id, k=2, top_n=3, genres=None, exclude=None):
+        """
+        Recommends movies for a user, described by the feature store with their predicted score.
+        :param genres: Only recommend movies of these genre codes, all genres when omitted.
+        :param exclude: Movie ids that must not be recommended, e.g. the ones already shown.
+        :return: A list of dicts in the shape of a MovieDto, with an additional score.
+        """
+        with self.lock:
+            return self._describe(*self._rank(user_id, k, top_n, genres, exclude))
+
+    def recommend_batch(self, user_ids, k=2, top_n=3):
+        """
+        Recommends movies for many users in one vectorized pass per chunk of users, instead of
+        one pass per user. Gives the same recommendations as recommend().
+        :return: A list with a list of recommended movie titles for every given user.
+        """
+        return self._recommend_in_chunks(user_ids, k, top_n, lambda rows, scores: self.features.titles[rows].tolist())
+
+    def recommend_movies_batch(self, user_ids, k=2, top_n=3):
+        """
+        Recommends movies for many users like recommend_batch(), described like recommend_movies().
+        :return: A list with a list of recommended movie dicts for every given user.
+        """
+        return self._recommend_in_chunks(user_ids, k, top_n, self._describe)
+
+    def apply_rating(self, user_id, movie_id, rating):
+        """
+        Applies a single created or updated rating to the model in place.
+        Only the user's row of the matrix, the user's norm, similarities and profile are recomputed.
+        :return: The ids of the users whose recommendations may have changed.
+        """
+        return self.apply_changes([(user_id, movie_id, rating)])
+
+    def remove_rating(self, user_id, movie_id):
+        """
+        Removes a single rating from the model in place.
+        :return: The ids of the users whose recommendations may have changed.
+        """
+        return self.apply_changes([(user_id, movie_id, None)])
+
+    def apply_changes(self, changes):
+        """
+        Applies many rating changes to the model in place, in order. Every changed user is
+        recomputed once, instead of once per rating.
+        :param changes: Iterable of (user_id, movie_id, rating) tuples, where a rating of None
+            removes the rating.
+        :return: The ids of the users whose recommendations may have changed.
+        """
+        with self.lock:
+            changed_users = {}
+            for user_id, movie_id, rating in changes:
+                if rating is None:
+                    if user_id not in self.user_index or movie_id not in self.movie_index:
+                        continue
+                    self.matrix.remove(self.user_index[user_id], self.movie_index[movie_id])
+                else:
+                    if user_id not in self.user_index:
+                        self._add_user(user_id)
+                    if movie_id not in self.movie_index:
+                        self._add_movie(movie_id)
+                    self.matrix.set(self.user_index[user_id], self.movie_index[movie_id], rating)
+                changed_users[user_id] = True
+
+            # All norms are updated first, so the similarity between two changed users is
+            # computed from both of their new norms
+            for user_id in changed_users:
+                user_index = self.user_index[user_id]
+                self.norms[user_index] = np.linalg.norm(self.matrix.row(user_index)[1].astype(np.float64))
+            affected = {}
+            for user_id in changed_users:
+                affected.update(dict.fromkeys(self._update_user(user_id)))
+            return list(affected)
+
+    def update_movie(self, movie_id, title, release_date, runtime, genre_id, imdb_id=None):
+        """
+        Applies a created or updated movie to the feature store in place, and recomputes the
+        profiles of the users who rated it. The similarities don't depend on the movie features.
+        :return: None
+        """
+        with self.lock:
+            row = self.features.set_movie(movie_id, title, release_date, runtime, genre_id, imdb_id)
+            if movie_id not in self.movie_index:
+                return
+            column = self.movie_index[movie_id]
+            self.column_rows[column] = row
+            for user_index in self.matrix.column_users(column):
+                self._update_profile(user_index)
+
+    def remove_movie(self, movie_id):
+        """
+        Removes a deleted movie and all of its ratings from the model in place. Its column is
+        kept without features, so it is never recommended again.
+        :return: The ids of the users whose recommendations may have changed.
+        """
+        with self.lock:
+            self.features.remove_movie(movie_id)
+            if movie_id not in self.movie_index:
+                return []
+            column = self.movie_index[movie_id]
+            self.column_rows[column] = MISSING
+            raters = self.matrix.user_ids[self.matrix.column_users(column)].tolist()
+            return self.apply_changes([(user_id, movie_id, None) for user_id in raters])
+
+    def remove_user(self, user_id):
+        """
+        Removes all ratings of a deleted user from the model in place. The user's row is kept
+        empty, so it is nobody's neighbour anymore.
+        :return: The ids of the users whose recommendations may have changed.
+        """
+        with self.lock:
+            if user_id not in self.user_index:
+                return []
+            columns, _ = self.matrix.row(self.user_index[user_id])
+            return self.apply_changes([(user_id, int(self.matrix.movie_ids[column]), None) for column in columns])
+
+    def _rank(self, user_id, k, top_n, genres=None, exclude=None):
+        """
+        Scores the movies the user hasn't rated and selects the top_n of them.
+        :return: A tuple (feature store rows, scores) of the recommended movies, best first.
+        """
+        if user_id not in self.user_index:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        user_index = self.user_index[user_id]
+        rated_columns = self.matrix.row(user_index)[0]
+        candidates = np.setdiff1d(np.arange(self.matrix.shape[1]), rated_columns)
+        candidates = candidates[self.column_rows[candidates] != MISSING]
+        if genres is not None:
+            candidates = candidates[np.isin(self.features.genres[self.column_rows[candidates]], list(genres))]
+        if exclude is not None:
+            candidates = candidates[~np.isin(self.matrix.movie_ids[candidates], list(exclude))]
+
+        top_k_users, similarities = self.neighbour_index.neighbours(user_index, k)
+        neighbour_ratings = self.matrix.dense_rows(top_k_users)[:, candidates]
+
+        candidate_rows = self.column_rows[candidates]
+        scores = score_candidates(neighbour_ratings, similarities,
+                                  *self.features.scoring_features(candidate_rows),
+                                  self.profiles.preferences(user_index))
+
+        top = top_candidates(self.features.movie_ids[candidate_rows], scores, top_n)
+        return candidate_rows[top], scores[top]
+
+    def _describe(self, rows, scores):
+        """
+        Describes the movies at the given feature store rows, with their predicted score.
+        """
+        movies = self.features.describe(rows)
+        for movie, score in zip(movies, scores):
+            movie["score"] = float(score)
+        return movies
+
+    def _recommend_in_chunks(self, user_ids, k, top_n, present):
+        """
+        Ranks the movies of many users chunk by chunk.
+        :param present: Function that turns the feature store rows and scores of a user's
+            recommended movies into the result for that user.
+        """
+        user_ids = list(user_ids)
+        recommendations = []
+        # Chunks are sized so the dense neighbour ratings stay within BLOCK_ELEMENTS
+        chunk_size = max(1, BLOCK_ELEMENTS // (max(k, 1) * max(self.matrix.shape[1], 1)))
+        for start in range(0, len(user_ids), chunk_size):
+            # The lock is released between chunks, so rating updates don't wait for the whole batch
+            with self.lock:
+                recommendations.extend(present(rows, scores)
+                                       for rows, scores in self._rank_chunk(user_ids[start:start + chunk_size], k, top_n))
+        return recommendations
+
+    def _rank_chunk(self, user_ids, k, top_n):
+        """
+        Scores every movie of the matrix for a chunk of users at once.
+        :return: A list with a tuple (feature store rows, scores) of the recommended movies of
+            every user, best first.
+        """
+        nothing = np.empty(0, dtype=np.int64), np.empty(0)
+        known = [user_id in self.user_index for user_id in user_ids]
+        user_indexes = np.array([self.user_index[user_id] for user_id in user_ids if user_id in self.user_index],
+                                dtype=np.int64)
+        n_users, n_movies = len(user_indexes), self.matrix.shape[1]
+        if not n_users or not n_movies or not len(self.features) or top_n <= 0:
+            return [nothing for _ in user_ids]
+
+        # Users with fewer than k neighbours are padded with empty neighbours of similarity 0
+        neighbour_indexes = np.full((n_users, k), -1, dtype=np.int64)
+        similarities = np.zeros((n_users, k))
+        for position, user_index in enumerate(user_indexes):
+            indexes, user_similarities = self.neighbour_index.neighbours(user_index, k)
+            neighbour_indexes[position, :len(indexes)] = indexes
+            similarities[position, :len(indexes)] = user_similarities
+
+        neighbour_ratings = np.full((n_users * k, n_movies), np.nan)
+        padded = neighbour_indexes.ravel() >= 0
+        neighbour_ratings[padded] = self.matrix.dense_rows(neighbour_indexes.ravel()[padded])
+        preferences = (self.profiles.preferred_runtimes[user_indexes],
+                       self.profiles.preferred_release_years[user_indexes],
+                       self.profiles.favorite_genres[user_indexes])
+        scores = score_candidates(neighbour_ratings.reshape(n_users, k, n_movies), similarities,
+                                  *self.features.scoring_features(self.column_rows), preferences)
+
+        # Movies without features and movies the user rated are not candidates
+        scores[:, self.column_rows == MISSING] = np.nan
+        counts = np.diff(self.matrix.indptr)[user_indexes]
+        rated_rows = np.repeat(np.arange(n_users), counts)
+        rated_columns = np.concatenate([self.matrix.row(user_index)[0] for user_index in user_indexes])
+        scores[rated_rows, rated_columns] = np.nan
+
+        # Ties are broken by movie id, like rank_candidates(), by sorting the columns by id first
+        by_id = np.argsort(self.matrix.movie_ids, kind='stable')
+        scores = scores[:, by_id]
+        order = np.argsort(np.where(np.isnan(scores), np.inf, -scores), axis=1, kind='stable')[:, :top_n]
+        top_scores = np.take_along_axis(scores, order, axis=1)
+        scored = ~np.isnan(top_scores)
+        rows = self.column_rows[by_id[order]]
+
+        chunk_recommendations = iter((user_rows[user_scored], user_scores[user_scored])
+                                     for user_rows, user_scores, user_scored in zip(rows, top_scores, scored))
+        return [next(chunk_recommendations) if is_known else nothing for is_known in known]
+
+    def _add_user(self, user_id):
+        """
+        Adds an empty row for a new user to the matrices.
+        """
+        self.matrix.add_user(user_id)
+        self.norms = np.append(self.norms, 0.0)
+        self.neighbour_index.add_user()
+        self.profiles.add_user()
+
+    def _add_movie(self, movie_id):
+        """
+        Adds an empty column for a new movie to the matrix. Movies created after the feature
+        store was built have no features until update_movie() is called for them.
+        """
+        self.matrix.add_movie(movie_id)
+        self.column_rows = np.append(self.column_rows, self.features.rows([movie_id]))
+
+    def _update_user(self, user_id):
+        """
+        Recomputes the norm, the similarities and the profile of a single user.
+        :return: The ids of the users whose neighbours may have changed, including the user itself.
+        """
+        user_index = self.user_index[user_id]
+        self.norms[user_index] = np.linalg.norm(self.matrix.row(user_index)[1].astype(np.float64))
+        affected = self.neighbour_index.update_user(self.matrix, self.norms, user_index)
+        self._update_profile(user_index)
+        return self.matrix.user_ids[affected].tolist()
+
+    def _update_profile(self, user_index):
+        """
+        Recomputes the profile of a single user from the user's ratings and the movie features.
+        """
+        columns, ratings = self.matrix.row(user_index)
+        self.profiles.update_user(user_index, ratings, *self.features.scoring_features(self.column_rows[columns]))
@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+
+from algorithm.lsh import LshNeighbourIndex
+
+# "exact" keeps the full users x users similarity matrix, "lsh" searches approximately without it
+NEIGHBOUR_BACKEND = os.getenv("RECOMMENDER_NEIGHBOUR_BACKEND", "exact")
+# Number of neighbours kept per user; requests for more neighbours bypass the cache
+NEIGHBOUR_CAPACITY = int(os.getenv("RECOMMENDER_NEIGHBOUR_CAPACITY", "20"))
+
+
+def create_neighbour_index(matrix, norms, backend=None):
+    """
+    Creates the neighbour index configured with RECOMMENDER_NEIGHBOUR_BACKEND.
+    :return: A NeighbourIndex or LshNeighbourIndex.
+    """
+    backend = backend or NEIGHBOUR_BACKEND
+    if backend == "exact":
+        return NeighbourIndex(matrix, norms)
+    if backend == "lsh":
+        return LshNeighbourIndex(matrix, norms)
+    raise ValueError(f"Unknown neighbour backend: {backend}")
+
+
+class NeighbourIndex:
+    """
+    Exact top-k neighbour index on top of the dense user similarity matrix.
+    The most similar users of a user are selected with a partial sort the first time
+    they are needed, and cached until a rating change affects them.
+    """
+
+    def __init__(self, matrix, norms, capacity=NEIGHBOUR_CAPACITY, similarity_matrix=None):
+        if similarity_matrix is None:
+            similarity_matrix = matrix.cosine_similarity(norms)
+        self.similarity_matrix = similarity_matrix
+        self.capacity = capacity
+        self._cache = {}
+        # Similarity of the last cached neighbour per user, inf for users without a cache entry
+        self._thresholds = np.full(matrix.shape[0], np.inf)
+
+    @classmethod
+    def from_arrays(cls, matrix, norms, arrays, capacity=NEIGHBOUR_CAPACITY):
+        """
+        Restores an index from the arrays returned by to_arrays(), without recomputing similarities.
+        :return: A new NeighbourIndex.
+        """
+        return cls(matrix, norms, capacity, similarity_matrix=arrays["similarity_matrix"])
+
+    def to_arrays(self):
+        """
+        Returns the arrays that from_arrays() needs to restore the index. Cached neighbours
+        are not included, they are selected again on first use.
+        """
+        return {"similarity_matrix": self.similarity_matrix}
+
+    def neighbours(self, user_index, k):
+        """
+        Returns the k most similar users of a user, most similar first.
+        :return: A tuple (user_indexes, similarities).
+        """
+        if k > self.capacity:
+            return self._select(user_index, k)
+
+        if user_index not in self._cache:
+            indexes, similarities = self._select(user_index, self.capacity)
+            self._cache[user_index] = indexes, similarities
+            # A short list holds every user, so any change can affect it
+            self._thresholds[user_index] = similarities[-1] if len(indexes) == self.capacity else -np.inf
+
+        indexes, similarities = self._cache[user_index]
+        return indexes[:k], similarities[:k]
+
+    def add_user(self):
+        """
+        Adds a user without similarities to the index.
+        """
+        self.similarity_matrix = np.pad(self.similarity_matrix, ((0, 1), (0, 1)))
+        self._thresholds = np.append(self._thresholds, np.inf)
+
+    def tracks(self, k):
+        """
+        Whether update_user() reports every user whose k nearest neighbours may change.
+        Lists longer than the capacity are not cached, so changes to them aren't tracked.
+        """
+        return k <= self.capacity
+
+    def update_user(self, matrix, norms, user_index):
+        """
+        Recomputes the similarities of a single user against all other users, and drops the
+        cached neighbours of every user whose top-k list may have changed because of it.
+        :return: The indexes of those users, including the user itself.
+        """
+        columns, ratings = matrix.row(user_index)
+        user_ratings = np.zeros(matrix.shape[1])
+        user_ratings[columns] = ratings
+
+        denominators = norms * norms[user_index]
+        similarities = np.divide(matrix.dot(user_ratings), denominators,
+                                 out=np.zeros(len(denominators)), where=denominators > 0)
+        similarities[user_index] = 0
+
+        old_similarities = self.similarity_matrix[:, user_index]
+        affected = (old_similarities >= self._thresholds) | (similarities >= self._thresholds)
+        affected[user_index] = True
+        for affected_index in np.flatnonzero(affected):
+            self._cache.pop(affected_index, None)
+        self._thresholds[affected] = np.inf
+
+        self.similarity_matrix[user_index, :] = similarities
+        self.similarity_matrix[:, user_index] = similarities
+        return np.flatnonzero(affected)
+
+    def _select(self, user_index, k):
+        """
+        Selects the k most similar users with argpartition instead of a full sort. The user
+        itself is never one of them.
+        """
+        row = self.similarity_matrix[user_index].copy()
+        row[user_index] = -np.inf
+        k = min(k, len(row) - 1)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = np.argpartition(row, -k)[-k:]
+        order = candidates[np.argsort(-row[candidates], kind='stable')]
+        return order, row[order]
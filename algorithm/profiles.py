@@ -0,0 +1,97 @@
+import numpy as np
+
+from algorithm.scoring import DEFAULT_RUNTIME, DEFAULT_RELEASE_YEAR, NO_GENRE, LIKED_RATING, user_preferences
+
+
+class UserProfiles:
+    """
+    Preferred runtime, preferred release year, favourite genre and number of liked movies
+    of every user, computed in bulk from the rating matrix and kept per matrix row.
+    """
+
+    def __init__(self, preferred_runtimes, preferred_release_years, favorite_genres, liked_counts):
+        self.preferred_runtimes = np.asarray(preferred_runtimes, dtype=np.float64)
+        self.preferred_release_years = np.asarray(preferred_release_years, dtype=np.float64)
+        self.favorite_genres = np.asarray(favorite_genres, dtype=np.int64)
+        self.liked_counts = np.asarray(liked_counts, dtype=np.int32)
+
+    @classmethod
+    def build(cls, matrix, runtimes, release_years, genres):
+        """
+        Computes the profiles of all users at once.
+        :param matrix: The RatingMatrix.
+        :param runtimes: Runtime per matrix column, NaN when unknown.
+        :param release_years: Release year per matrix column, NaN when unknown.
+        :param genres: Genre code per matrix column, NO_GENRE when unknown.
+        :return: A new UserProfiles.
+        """
+        n_users = matrix.shape[0]
+        rows = np.repeat(np.arange(n_users), np.diff(matrix.indptr))
+        liked = matrix.data > LIKED_RATING
+        liked_rows, liked_columns = rows[liked], matrix.indices[liked]
+        liked_counts = np.bincount(liked_rows, minlength=n_users)
+
+        preferred_runtimes = _mean_per_row(liked_rows, runtimes[liked_columns], n_users)
+        preferred_release_years = _mean_per_row(liked_rows, release_years[liked_columns], n_users)
+        favorite_genres = _mode_per_row(liked_rows, genres[liked_columns], n_users)
+
+        no_likes = liked_counts == 0
+        preferred_runtimes[no_likes] = DEFAULT_RUNTIME
+        preferred_release_years[no_likes] = DEFAULT_RELEASE_YEAR
+        return cls(preferred_runtimes, preferred_release_years, favorite_genres, liked_counts)
+
+    def preferences(self, user_index):
+        """
+        Returns the preferences of a user, in the form expected by score_candidates().
+        """
+        return (self.preferred_runtimes[user_index], self.preferred_release_years[user_index],
+                int(self.favorite_genres[user_index]))
+
+    def add_user(self):
+        """
+        Adds the default profile of a user without ratings.
+        """
+        self.preferred_runtimes = np.append(self.preferred_runtimes, DEFAULT_RUNTIME)
+        self.preferred_release_years = np.append(self.preferred_release_years, DEFAULT_RELEASE_YEAR)
+        self.favorite_genres = np.append(self.favorite_genres, NO_GENRE)
+        self.liked_counts = np.append(self.liked_counts, 0).astype(np.int32)
+
+    def update_user(self, user_index, ratings, runtimes, release_years, genres):
+        """
+        Recomputes the profile of a single user after the user's ratings changed.
+        :param ratings: All ratings of the user.
+        :param runtimes: Runtime of every rated movie, NaN when unknown.
+        :param release_years: Release year of every rated movie, NaN when unknown.
+        :param genres: Genre code of every rated movie.
+        """
+        preferences = user_preferences(ratings, runtimes, release_years, genres)
+        self.preferred_runtimes[user_index], self.preferred_release_years[user_index], \
+            self.favorite_genres[user_index] = preferences
+        self.liked_counts[user_index] = np.count_nonzero(ratings > LIKED_RATING)
+
+
+def _mean_per_row(rows, values, n_rows):
+    """
+    Mean of the known values per row, NaN for rows without any known value.
+    """
+    known = ~np.isnan(values)
+    totals = np.bincount(rows[known], weights=values[known], minlength=n_rows)
+    counts = np.bincount(rows[known], minlength=n_rows)
+    return np.divide(totals, counts, out=np.full(n_rows, np.nan), where=counts > 0)
+
+
+def _mode_per_row(rows, values, n_rows):
+    """
+    Most common value per row, the lowest one on ties, NO_GENRE for rows without values.
+    """
+    modes = np.full(n_rows, NO_GENRE, dtype=np.int64)
+    known = values != NO_GENRE
+    if not known.any():
+        return modes
+
+    pairs, counts = np.unique(np.stack([rows[known], values[known]]), axis=1, return_counts=True)
+    order = np.lexsort((pairs[1], -counts, pairs[0]))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pairs[0, order[1:]] != pairs[0, order[:-1]]
+    modes[pairs[0, order[first]]] = pairs[1, order[first]]
+    return modes
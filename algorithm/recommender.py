@@ -0,0 +1,327 @@
+import threading
+import time
+
+from algorithm.loader import load_ratings, load_movie_features
+from algorithm import snapshot
+from algorithm.cache import RecommendationCache
+from algorithm.feed import FeedQueues, FEED_NEIGHBOURS
+from algorithm.model import RecommenderModel
+from algorithm.sparse import RatingMatrix
+from database import SessionLocal
+
+# The model shared by all requests of this process. It is only ever replaced as a whole,
+# so readers either see the old or the new model, never a half-built one.
+_model = None
+# Serializes model builds
+_build_lock = threading.RLock()
+# Orders rating changes against model swaps
+_update_lock = threading.Lock()
+# Changes seen while a build is running, as functions of the model that are replayed onto the
+# new model before the swap
+_journal = None
+# Rating changes applied to the current model since it was built
+_dirty_ratings = 0
+_last_version = 0
+# Final recommendation lists of the current model
+result_cache = RecommendationCache()
+# Ranked candidate queues of the users' feeds
+feed_queues = FeedQueues()
+
+
+def build_model():
+    """
+    Builds a new recommender model from the current database contents.
+    :return: A new RecommenderModel.
+    """
+    started = time.time()
+    with SessionLocal() as db:
+        matrix = RatingMatrix.from_ratings(*load_ratings(db))
+        features = load_movie_features(db)
+    model = RecommenderModel(matrix, features)
+    model.version = _next_version(started)
+    model.build_duration = time.time() - started
+    return model
+
+
+def get_model():
+    """
+    Returns the shared recommender model, built from the database if it doesn't exist yet.
+    Snapshots are only loaded at startup, so a model dropped by reset_model() is always rebuilt
+    from the current database contents.
+    :return: The current RecommenderModel.
+    """
+    model = _model
+    if model is None:
+        with _build_lock:
+            model = _model
+            if model is None:
+                model = rebuild_model()
+    return model
+
+
+def load_latest_snapshot():
+    """
+    Loads the latest model snapshot, if snapshots are enabled and there is one, and swaps it in.
+    Called once at startup, which then requests a rebuild in the background to pick up the
+    ratings changed after the snapshot was built.
+    :return: The loaded RecommenderModel, or None.
+    """
+    global _model, _dirty_ratings, _last_version
+    path = snapshot.latest_snapshot(snapshot.SNAPSHOT_DIR)
+    if path is None:
+        return None
+
+    try:
+        model = snapshot.load_snapshot(path)
+    except Exception as err:
+        print(f"Failed to load recommender snapshot {path}: {err}")
+        return None
+
+    with _update_lock:
+        _model = model
+        _dirty_ratings = 0
+        _last_version = max(_last_version, model.version)
+        result_cache.clear()
+        feed_queues.clear()
+    print(f"Loaded recommender snapshot {path}")
+    return model
+
+
+def current_model():
+    """
+    Returns the shared recommender model without building it.
+    :return: The current RecommenderModel, or None if it hasn't been built.
+    """
+    return _model
+
+
+def dirty_ratings():
+    """
+    Returns the number of rating changes applied to the current model since it was built.
+    """
+    return _dirty_ratings
+
+
+def rebuild_model():
+    """
+    Builds a new model from the database and swaps it in for the current one. Requests keep
+    using the current model while the new one is built; rating changes made in the meantime
+    are applied to both.
+    :return: The new RecommenderModel.
+    """
+    global _model, _journal, _dirty_ratings
+    with _build_lock:
+        with _update_lock:
+            _journal = []
+        try:
+            model = build_model()
+        except Exception:
+            with _update_lock:
+                _journal = None
+            raise
+
+        # The snapshot is written before the swap, while no request uses the new model and
+        # waits for its lock. Changes from the journal are picked up by the next rebuild.
+        if snapshot.SNAPSHOT_DIR:
+            try:
+                snapshot.save_snapshot(model, snapshot.SNAPSHOT_DIR)
+            except OSError as err:
+                print(f"Failed to save recommender snapshot: {err}")
+
+        with _update_lock:
+            # Changes already in the database are applied twice, which doesn't change the result
+            for change in _journal:
+                change(model)
+            _model = model
+            _journal = None
+            _dirty_ratings = 0
+            result_cache.clear()
+            feed_queues.clear()
+        return model
+
+
+def reset_model():
+    """
+    Drops the shared recommender model, so it is rebuilt from the database on next use.
+    :return: None
+    """
+    global _model, _dirty_ratings
+    with _update_lock:
+        _model = None
+        _dirty_ratings = 0
+        result_cache.clear()
+        feed_queues.clear()
+
+
+def cached_recommendations(user_id, k, top_n, genres=None, exclude=None):
+    """
+    Returns the cached recommendations of a user, without computing anything.
+    :return: A list of recommended movies, or None when they aren't cached.
+    """
+    model = _model
+    if model is None or not model.tracks_changes(k):
+        return None
+    return result_cache.get(user_id, k, top_n, model.version, _filters(genres, exclude))
+
+
+def recommend(user_id, k, top_n, genres=None, exclude=None):
+    """
+    Computes the recommendations of a user with the shared model and caches them.
+    :param genres: Only recommend movies of these genre ids.
+    :param exclude: Movie ids that must not be recommended.
+    :return: A list of recommended movies, as returned by RecommenderModel.recommend_movies().
+    """
+    model = get_model()
+    generation = result_cache.generation
+    recommendations = model.recommend_movies(user_id, k=k, top_n=top_n, genres=genres, exclude=exclude)
+    if model.tracks_changes(k):
+        result_cache.put(user_id, k, top_n, model.version, recommendations, generation, _filters(genres, exclude))
+    return recommendations
+
+
+def feed(user_id, n):
+    """
+    Returns the next cards of a user's feed, filling the user's queue first if it is empty.
+    :return: A list of up to n recommended movies, as returned by RecommenderModel.recommend_movies().
+    """
+    cards = feed_queues.peek(user_id, n)
+    if cards is None:
+        if refill_feed(user_id):
+            cards = feed_queues.peek(user_id, n)
+        if cards is None:
+            # Another request is filling the queue, so rank the cards without storing them
+            cards = _rank_feed(user_id)[:n]
+    return cards
+
+
+def refill_feed(user_id):
+    """
+    Ranks the candidates of a user's feed with the shared model and stores them in the user's
+    queue, unless the queue is already being refilled.
+    :return: Whether the queue was refilled.
+    """
+    # The model is built before the refill starts, because swapping in a new model drops the queues
+    model = get_model()
+    if not feed_queues.start_refill(user_id):
+        return False
+    try:
+        cards = _rank_feed(user_id, model)
+    except Exception:
+        feed_queues.abort_refill(user_id)
+        raise
+    feed_queues.finish_refill(user_id, cards)
+    return True
+
+
+def apply_rating(user_id, movie_id, rating):
+    """
+    Applies a created or updated rating to the shared model, if it has been built.
+    A model that hasn't been built yet will read the rating from the database anyway.
+    :return: None
+    """
+    apply_changes([(user_id, movie_id, rating)])
+
+
+def remove_rating(user_id, movie_id):
+    """
+    Removes a deleted rating from the shared model, if it has been built.
+    :return: None
+    """
+    apply_changes([(user_id, movie_id, None)])
+
+
+def apply_changes(changes):
+    """
+    Applies a batch of rating changes to the shared model at once, if it has been built.
+    :param changes: Iterable of (user_id, movie_id, rating) tuples, where a rating of None is a removal.
+    :return: None
+    """
+    global _dirty_ratings
+    changes = [change for change in changes if change[0] is not None and change[1] is not None]
+    if not changes:
+        return
+
+    with _update_lock:
+        affected_users = _apply_to_models(lambda model: model.apply_changes(changes))
+        if affected_users is not None:
+            result_cache.invalidate_users(affected_users)
+            _dirty_ratings += len(changes)
+
+    # Rated movies are consumed from the feeds, removed ratings make movies candidates at the next refill
+    rated_movies = {}
+    for user_id, movie_id, rating in changes:
+        rated_movies.setdefault(user_id, []).append(movie_id)
+    for user_id, movie_ids in rated_movies.items():
+        feed_queues.consume(user_id, movie_ids)
+
+
+def update_movie(movie_id, title, release_date, runtime, genre_id, imdb_id=None):
+    """
+    Applies a created or updated movie to the shared model, if it has been built. Movie details
+    are part of every cached recommendation list and feed, so all of them are dropped.
+    :return: None
+    """
+    with _update_lock:
+        _apply_to_models(lambda model: model.update_movie(movie_id, title, release_date, runtime, genre_id, imdb_id))
+        result_cache.clear()
+    feed_queues.clear()
+
+
+def remove_movie(movie_id):
+    """
+    Removes a deleted movie and its ratings from the shared model, if it has been built, so
+    it isn't recommended anymore.
+    :return: None
+    """
+    with _update_lock:
+        _apply_to_models(lambda model: model.remove_movie(movie_id))
+        result_cache.clear()
+    feed_queues.clear()
+
+
+def remove_user(user_id):
+    """
+    Removes the ratings of a deleted user from the shared model, if it has been built, so the
+    user isn't used as a neighbour anymore.
+    :return: None
+    """
+    with _update_lock:
+        affected_users = _apply_to_models(lambda model: model.remove_user(user_id))
+        result_cache.invalidate_users((affected_users or []) + [user_id])
+    feed_queues.drop(user_id)
+
+
+def _apply_to_models(change):
+    """
+    Applies a change to the current model, and records it for the model that is being built.
+    Must be called while holding _update_lock.
+    :param change: Function that applies the change to a RecommenderModel.
+    :return: The result of the change on the current model, or None if it hasn't been built.
+    """
+    if _journal is not None:
+        _journal.append(change)
+    if _model is not None:
+        return change(_model)
+    return None
+
+
+def _rank_feed(user_id, model=None):
+    return (model or get_model()).recommend_movies(user_id, k=FEED_NEIGHBOURS, top_n=feed_queues.depth)
+
+
+def _filters(genres, exclude):
+    """
+    Cache key part for the optional filters of a recommendation request.
+    """
+    return (None if genres is None else tuple(sorted(set(genres))),
+            None if exclude is None else tuple(sorted(set(exclude))))
+
+
+def _next_version(started):
+    """
+    Model versions are build start times in milliseconds, made unique within the process.
+    """
+    global _last_version
+    with _update_lock:
+        _last_version = max(int(started * 1000), _last_version + 1)
+        return _last_version
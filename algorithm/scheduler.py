@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+from algorithm import recommender
+
+# Rebuild the model when it is older than this many seconds, 0 disables
+REBUILD_INTERVAL = float(os.getenv("RECOMMENDER_REBUILD_INTERVAL", "0"))
+# Rebuild the model after this many incremental rating changes, 0 disables
+REBUILD_DIRTY_RATINGS = int(os.getenv("RECOMMENDER_REBUILD_DIRTY_RATINGS", "0"))
+POLL_INTERVAL = 1.0
+# Upper bound for the seconds a due rebuild waits after failed rebuilds, which double the wait
+MAX_RETRY_DELAY = 300.0
+
+
+class RebuildScheduler:
+    """
+    Background thread that rebuilds the recommender model off the request path, when it gets
+    too old or too many ratings changed since it was built, or when a rebuild is requested.
+    """
+
+    def __init__(self, interval=REBUILD_INTERVAL, dirty_threshold=REBUILD_DIRTY_RATINGS,
+                 poll_interval=POLL_INTERVAL):
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.poll_interval = poll_interval
+        self.rebuilding = False
+        self.last_error = None
+        # Consecutive failed rebuilds, and when a due rebuild may be retried after them
+        self._failures = 0
+        self._retry_at = 0.0
+        self._requested = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Thread serving requested rebuilds while the scheduler thread isn't running
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.interval > 0 or self.dirty_threshold > 0
+
+    def start(self):
+        """
+        Starts the scheduler thread, if an interval or dirty threshold is configured.
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="recommender-rebuild", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the scheduler thread, after the rebuild in progress if there is one.
+        """
+        self._stopped.set()
+        self._requested.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def request_rebuild(self):
+        """
+        Rebuilds the model in the background as soon as possible.
+        """
+        if self._thread is not None:
+            self._requested.set()
+            return
+
+        # Requests made while a rebuild is pending or running are served by one more rebuild
+        with self._worker_lock:
+            self._requested.set()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run_requested, name="recommender-rebuild", daemon=True)
+                self._worker.start()
+
+    def rebuild(self):
+        """
+        Rebuilds the model on the calling thread and swaps it in.
+        """
+        self.rebuilding = True
+        try:
+            recommender.rebuild_model()
+            self.last_error = None
+            self._failures = 0
+            self._retry_at = 0.0
+        except Exception as err:
+            print(f"Failed to rebuild the recommender model: {err}")
+            self.last_error = str(err)
+            self._failures += 1
+            self._retry_at = time.time() + min(self.poll_interval * 2 ** self._failures, MAX_RETRY_DELAY)
+        finally:
+            self.rebuilding = False
+
+    def is_due(self):
+        """
+        Whether the current model is older than the interval or has too many rating changes.
+        A model that hasn't been built yet is built on first use instead. After failed rebuilds
+        the next one is only due after a delay, so an unavailable database isn't loaded every poll.
+        """
+        model = recommender.current_model()
+        if model is None or time.time() < self._retry_at:
+            return False
+        if self.interval > 0 and time.time() - model.built_at >= self.interval:
+            return True
+        return 0 < self.dirty_threshold <= recommender.dirty_ratings()
+
+    def _run_requested(self):
+        while True:
+            with self._worker_lock:
+                if not self._requested.is_set():
+                    self._worker = None
+                    return
+                self._requested.clear()
+            self.rebuild()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._requested.wait(self.poll_interval)
+            if self._stopped.is_set():
+                break
+            if self._requested.is_set() or self.is_due():
+                self._requested.clear()
+                self.rebuild()
+
+
+# The scheduler of this process, started together with the app
+scheduler = RebuildScheduler()
@@ -0,0 +1,93 @@
+import numpy as np
+
+# Preferences used for users that haven't liked any movie yet
+DEFAULT_RUNTIME = 100
+DEFAULT_RELEASE_YEAR = 2010
+NO_GENRE = -1
+
+# Ratings above this value count as liked
+LIKED_RATING = 3
+
+
+def user_preferences(ratings, runtimes, release_years, genres):
+    """
+    Computes the preferred runtime, release year and favourite genre of a user from the
+    movies the user liked, using arrays aligned with the user's ratings.
+    Missing runtimes and release years are NaN, missing genres are NO_GENRE.
+    :return: A tuple (preferred_runtime, preferred_release_year, favorite_genre).
+    """
+    liked = np.asarray(ratings) > LIKED_RATING
+    if not liked.any():
+        return DEFAULT_RUNTIME, DEFAULT_RELEASE_YEAR, NO_GENRE
+
+    liked_runtimes = np.asarray(runtimes, dtype=np.float64)[liked]
+    liked_years = np.asarray(release_years, dtype=np.float64)[liked]
+    liked_genres = np.asarray(genres)[liked]
+    liked_genres = liked_genres[liked_genres != NO_GENRE]
+
+    preferred_runtime = _nan_mean(liked_runtimes)
+    preferred_release_year = _nan_mean(liked_years)
+    # Ties go to the lowest genre code, like pandas' mode()
+    favorite_genre = int(np.argmax(np.bincount(liked_genres))) if len(liked_genres) else NO_GENRE
+
+    return preferred_runtime, preferred_release_year, favorite_genre
+
+
+def score_candidates(neighbour_ratings, neighbour_similarities, runtimes, release_years, genres, preferences):
+    """
+    Predicts the score of all candidate movies at once. Leading batch dimensions score the same
+    candidates for several users in one pass, with one set of neighbours and preferences per user.
+    :param neighbour_ratings: ([users x] neighbours x candidates) array of ratings, NaN where a neighbour didn't rate.
+    :param neighbour_similarities: ([users x] neighbours) similarity of each neighbour to the user.
+    :param runtimes: Runtime of every candidate, NaN when unknown.
+    :param release_years: Release year of every candidate, NaN when unknown.
+    :param genres: Genre code of every candidate.
+    :param preferences: The user's preferences, as returned by user_preferences(), or a tuple of
+        arrays with the preferences of every user of the batch.
+    :return: An array with the score of every candidate, NaN where no prediction can be made.
+    """
+    preferred_runtime, preferred_release_year, favorite_genre = (np.asarray(preference)[..., None]
+                                                                 for preference in preferences)
+    neighbour_ratings = np.asarray(neighbour_ratings, dtype=np.float64)
+
+    rated = ~np.isnan(neighbour_ratings)
+    weights = rated * np.asarray(neighbour_similarities, dtype=np.float64)[..., None]
+    total_similarity = weights.sum(axis=-2)
+    predictable = rated.any(axis=-2) & (total_similarity != 0)
+
+    weighted_ratings = np.full(total_similarity.shape, np.nan)
+    np.divide((np.where(rated, neighbour_ratings, 0) * weights).sum(axis=-2), total_similarity,
+              out=weighted_ratings, where=predictable)
+
+    # fmax treats unknown runtimes and years as a weight of 0
+    runtime_weight = np.fmax(0, 1 - np.abs(np.asarray(runtimes, dtype=np.float64) - preferred_runtime) / 100)
+    release_weight = np.fmax(0, 1 - np.abs(np.asarray(release_years, dtype=np.float64) - preferred_release_year) / 20)
+    time_release = (runtime_weight + release_weight) / 2
+    genre_factor = np.where((np.asarray(genres) == favorite_genre) & (favorite_genre != NO_GENRE), 1.2, 1.0)
+
+    return weighted_ratings * time_release * genre_factor
+
+
+def rank_candidates(movie_ids, scores, top_n):
+    """
+    Returns the ids of the top_n highest scoring movies. Movies without a score are skipped
+    and ties are broken by movie id.
+    """
+    movie_ids = np.asarray(movie_ids)
+    return movie_ids[top_candidates(movie_ids, scores, top_n)]
+
+
+def top_candidates(movie_ids, scores, top_n):
+    """
+    Returns the positions of the top_n highest scoring movies, ranked like rank_candidates().
+    """
+    movie_ids = np.asarray(movie_ids)
+    scores = np.asarray(scores)
+    scored = np.flatnonzero(~np.isnan(scores))
+    order = scored[np.lexsort((movie_ids[scored], -scores[scored]))]
+    return order[:top_n]
+
+
+def _nan_mean(values):
+    values = values[~np.isnan(values)]
+    return values.mean() if len(values) else np.nan
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from algorithm.features import MovieFeatures
+from algorithm.lsh import LshNeighbourIndex
+from algorithm.model import RecommenderModel
+from algorithm.neighbours import NeighbourIndex
+from algorithm.profiles import UserProfiles
+from algorithm.sparse import RatingMatrix
+
+# Directory the built models are saved to and loaded from, empty disables snapshots
+SNAPSHOT_DIR = os.getenv("RECOMMENDER_SNAPSHOT_DIR", "")
+# Number of snapshots kept on disk, older ones are deleted after saving a new one
+SNAPSHOT_KEEP = int(os.getenv("RECOMMENDER_SNAPSHOT_KEEP", "2"))
+
+METADATA_FILE = "model.json"
+NEIGHBOUR_BACKENDS = {"exact": NeighbourIndex, "lsh": LshNeighbourIndex}
+
+
+def save_snapshot(model, directory=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """
+    Saves a model as one .npy file per array in a subdirectory named after the model version.
+    The snapshot is written to a temporary directory first and then renamed, so other
+    processes never load a partially written snapshot.
+    :return: The path of the snapshot directory.
+    """
+    path = os.path.join(directory, str(model.version))
+    temporary_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(temporary_path, exist_ok=True)
+
+    with model.lock:
+        arrays = _model_arrays(model)
+        metadata = {
+            "version": model.version,
+            "built_at": model.built_at,
+            "build_duration": model.build_duration,
+            "neighbour_backend": _neighbour_backend(model.neighbour_index),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_path, f"{name}.npy"), array, allow_pickle=False)
+    with open(os.path.join(temporary_path, METADATA_FILE), "w") as file:
+        json.dump(metadata, file)
+
+    try:
+        os.rename(temporary_path, path)
+    except OSError:
+        # Another process saved the same version in the meantime
+        shutil.rmtree(temporary_path, ignore_errors=True)
+    _delete_old_snapshots(directory, keep)
+    return path
+
+
+def load_snapshot(path, mmap_mode="c"):
+    """
+    Loads a model saved by save_snapshot(). The arrays are memory-mapped instead of read,
+    so processes loading the same snapshot share its pages through the page cache. With the
+    default copy-on-write mode, incremental rating updates make private copies of the pages
+    they change, so the sharing only lasts until the first rating writes: every update writes
+    a row and a column of the exact similarity matrix, which touches a page of most rows, and
+    a rating of a new user reallocates the whole matrix in private memory. The sharing is
+    restored when the workers load the next snapshot.
+    :param path: The snapshot directory.
+    :param mmap_mode: The mmap_mode passed to numpy.load().
+    :return: The restored RecommenderModel.
+    """
+    with open(os.path.join(path, METADATA_FILE)) as file:
+        metadata = json.load(file)
+
+    def load(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+
+    matrix = RatingMatrix(load("matrix_indptr"), load("matrix_indices"), load("matrix_data"),
+                          load("matrix_user_ids"), load("matrix_movie_ids"))
+    features = MovieFeatures(load("features_movie_ids"), _objects(load("features_titles")),
+                             load("features_release_years"), load("features_runtimes"), load("features_genres"),
+                             load("features_release_dates"), _objects(load("features_imdb_ids")))
+    profiles = UserProfiles(load("profiles_preferred_runtimes"), load("profiles_preferred_release_years"),
+                            load("profiles_favorite_genres"), load("profiles_liked_counts"))
+
+    index_class = NEIGHBOUR_BACKENDS[metadata["neighbour_backend"]]
+    index_names = [name.removesuffix(".npy") for name in os.listdir(path) if name.startswith("neighbours_")]
+    index_arrays = {name.removeprefix("neighbours_"): load(name) for name in index_names}
+    neighbour_index = index_class.from_arrays(matrix, matrix.row_norms(), index_arrays)
+
+    model = RecommenderModel(matrix, features, neighbour_index=neighbour_index, profiles=profiles)
+    model.version = metadata["version"]
+    model.built_at = metadata["built_at"]
+    model.build_duration = metadata["build_duration"]
+    return model
+
+
+def latest_snapshot(directory=SNAPSHOT_DIR):
+    """
+    Returns the path of the newest complete snapshot in a directory.
+    :return: The snapshot directory, or None if there is none.
+    """
+    versions = _snapshot_versions(directory)
+    return os.path.join(directory, str(versions[-1])) if versions else None
+
+
+def _model_arrays(model):
+    """
+    Collects the arrays of a model by file name.
+    """
+    matrix, features, profiles = model.matrix, model.features, model.profiles
+    arrays = {
+        "matrix_indptr": matrix.indptr,
+        "matrix_indices": matrix.indices,
+        "matrix_data": matrix.data,
+        "matrix_user_ids": matrix.user_ids,
+        "matrix_movie_ids": matrix.movie_ids,
+        "features_movie_ids": features.movie_ids,
+        "features_titles": _strings(features.titles),
+        "features_release_years": features.release_years,
+        "features_runtimes": features.runtimes,
+        "features_genres": features.genres,
+        "features_release_dates": features.release_dates,
+        "features_imdb_ids": _strings(features.imdb_ids),
+        "profiles_preferred_runtimes": profiles.preferred_runtimes,
+        "profiles_preferred_release_years": profiles.preferred_release_years,
+        "profiles_favorite_genres": profiles.favorite_genres,
+        "profiles_liked_counts": profiles.liked_counts,
+    }
+    for name, array in model.neighbour_index.to_arrays().items():
+        arrays[f"neighbours_{name}"] = array
+    return arrays
+
+
+def _strings(values):
+    """
+    Converts an object array of strings to a fixed width string array that can be memory-mapped,
+    with None stored as an empty string.
+    """
+    return np.array(["" if value is None else value for value in values], dtype=str)
+
+
+def _objects(strings):
+    """
+    Converts a fixed width string array back to Python strings, the reverse of _strings().
+    """
+    values = strings.astype(object)
+    values[values == ""] = None
+    return values
+
+
+def _neighbour_backend(neighbour_index):
+    for backend, index_class in NEIGHBOUR_BACKENDS.items():
+        if type(neighbour_index) is index_class:
+            return backend
+    raise ValueError(f"Unknown neighbour index: {type(neighbour_index).__name__}")
+
+
+def _snapshot_versions(directory):
+    """
+    Versions of the complete snapshots in a directory, oldest first.
+    """
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(int(name) for name in os.listdir(directory)
+                  if name.isdigit() and os.path.isfile(os.path.join(directory, name, METADATA_FILE)))
+
+
+def _delete_old_snapshots(directory, keep):
+    # Processes that still map an old snapshot keep reading it after the files are deleted
+    for version in _snapshot_versions(directory)[:-keep]:
+        shutil.rmtree(os.path.join(directory, str(version)), ignore_errors=True)
@@ -0,0 +1,209 @@
+import numpy as np
+
+# Upper bound for the number of elements in the dense temporary blocks used while
+# computing similarities, so memory use doesn't grow with users x movies.
+BLOCK_ELEMENTS = 1 << 22
+
+
+class RatingMatrix:
+    """
+    Sparse user-item rating matrix in CSR layout, backed by plain NumPy arrays.
+    Rows are users and columns are movies. Row and column indexes are mapped to and
+    from user and movie ids, and ratings are stored explicitly, so a rating of 0 is
+    still a rating.
+    """
+
+    def __init__(self, indptr, indices, data, user_ids, movie_ids):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.user_index = {int(user_id): index for index, user_id in enumerate(self.user_ids)}
+        self.movie_index = {int(movie_id): index for index, movie_id in enumerate(self.movie_ids)}
+
+    @classmethod
+    def from_ratings(cls, user_ids, movie_ids, ratings):
+        """
+        Builds a matrix from parallel arrays of user ids, movie ids and ratings.
+        When a user rated the same movie more than once, the last rating wins.
+        :return: A new RatingMatrix.
+        """
+        unique_users, rows = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        unique_movies, columns = np.unique(np.asarray(movie_ids, dtype=np.int64), return_inverse=True)
+        ratings = np.asarray(ratings, dtype=np.float32)
+
+        order = np.lexsort((columns, rows))
+        rows, columns, ratings = rows[order], columns[order], ratings[order]
+
+        # Keep the last of every run of duplicate (user, movie) pairs
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        rows, columns, ratings = rows[last], columns[last], ratings[last]
+
+        indptr = np.zeros(len(unique_users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(unique_users)), out=indptr[1:])
+        return cls(indptr, columns, ratings, unique_users, unique_movies)
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.movie_ids)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row(self, user_index):
+        """
+        Returns the column indexes and ratings of a single user.
+        """
+        start, stop = self.indptr[user_index], self.indptr[user_index + 1]
+        return self.indices[start:stop], self.data[start:stop]
+
+    def dense_rows(self, user_indexes):
+        """
+        Returns the ratings of the given users as a dense block, with NaN for missing ratings.
+        """
+        block = np.full((len(user_indexes), self.shape[1]), np.nan)
+        for position, user_index in enumerate(user_indexes):
+            columns, ratings = self.row(user_index)
+            block[position, columns] = ratings
+        return block
+
+    def get(self, user_index, movie_index):
+        """
+        Returns a single rating, or NaN if the user didn't rate the movie.
+        """
+        columns, ratings = self.row(user_index)
+        position = np.searchsorted(columns, movie_index)
+        if position < len(columns) and columns[position] == movie_index:
+            return float(ratings[position])
+        return np.nan
+
+    def set(self, user_index, movie_index, rating):
+        """
+        Sets a single rating in place, inserting it into the user's row if it is new.
+        """
+        start, stop = self.indptr[user_index], self.indptr[user_index + 1]
+        position = start + np.searchsorted(self.indices[start:stop], movie_index)
+        if position < stop and self.indices[position] == movie_index:
+            self.data[position] = rating
+            return
+
+        self.indices = np.insert(self.indices, position, movie_index)
+        self.data = np.insert(self.data, position, rating)
+        self.indptr[user_index + 1:] += 1
+
+    def remove(self, user_index, movie_index):
+        """
+        Removes a single rating in place. Removing a missing rating does nothing.
+        """
+        start, stop = self.indptr[user_index], self.indptr[user_index + 1]
+        position = start + np.searchsorted(self.indices[start:stop], movie_index)
+        if position == stop or self.indices[position] != movie_index:
+            return
+
+        self.indices = np.delete(self.indices, position)
+        self.data = np.delete(self.data, position)
+        self.indptr[user_index + 1:] -= 1
+
+    def column_users(self, movie_index):
+        """
+        Returns the row indexes of the users who rated a movie. The CSR layout has no column
+        index, so this scans all ratings.
+        """
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return rows[self.indices == movie_index]
+
+    def add_user(self, user_id):
+        """
+        Appends an empty row for a new user.
+        :return: The row index of the user.
+        """
+        self.user_index[user_id] = len(self.user_ids)
+        self.user_ids = np.append(self.user_ids, user_id)
+        self.indptr = np.append(self.indptr, self.indptr[-1])
+        return self.user_index[user_id]
+
+    def add_movie(self, movie_id):
+        """
+        Appends an empty column for a new movie.
+        :return: The column index of the movie.
+        """
+        self.movie_index[movie_id] = len(self.movie_ids)
+        self.movie_ids = np.append(self.movie_ids, movie_id)
+        return self.movie_index[movie_id]
+
+    def row_norms(self):
+        """
+        Returns the euclidean norm of every user's ratings.
+        """
+        squares = np.zeros(self.shape[0])
+        nonempty = np.flatnonzero(np.diff(self.indptr))
+        if len(nonempty):
+            squares[nonempty] = np.add.reduceat(self.data.astype(np.float64) ** 2, self.indptr[nonempty])
+        return np.sqrt(squares)
+
+    def dot(self, dense):
+        """
+        Multiplies the matrix with a dense (movies x n) array or a vector of length movies.
+        :return: A dense (users x n) array, or a vector of length users.
+        """
+        dense = np.asarray(dense, dtype=np.float64)
+        vector = dense.ndim == 1
+        if vector:
+            dense = dense[:, None]
+
+        result = np.zeros((self.shape[0], dense.shape[1]))
+        nonempty = np.flatnonzero(np.diff(self.indptr))
+        if len(nonempty):
+            products = self.data[:, None] * dense[self.indices]
+            result[nonempty] = np.add.reduceat(products, self.indptr[nonempty], axis=0)
+        return result[:, 0] if vector else result
+
+    def row_dots(self, user_indexes, vector):
+        """
+        Multiplies the rows of the given users with a dense vector of length movies.
+        :return: A vector with one dot product per user.
+        """
+        user_indexes = np.asarray(user_indexes, dtype=np.int64)
+        starts = self.indptr[user_indexes]
+        lengths = self.indptr[user_indexes + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        products = self.data[positions] * np.asarray(vector, dtype=np.float64)[self.indices[positions]]
+        return np.bincount(np.repeat(np.arange(len(user_indexes)), lengths), weights=products,
+                           minlength=len(user_indexes))
+
+    def cosine_similarity(self, norms=None):
+        """
+        Computes the cosine similarity between all users. The dot products are accumulated
+        over blocks of movie columns, so the ratings are never expanded to a dense
+        users x movies array.
+        Users without ratings have a similarity of 0 to everyone, as has every user to itself.
+        :return: A dense (users x users) similarity matrix.
+        """
+        n_users, n_movies = self.shape
+        if norms is None:
+            norms = self.row_norms()
+
+        rows = np.repeat(np.arange(n_users), np.diff(self.indptr))
+        by_column = np.argsort(self.indices, kind='stable')
+        sorted_columns = self.indices[by_column]
+
+        similarity = np.zeros((n_users, n_users))
+        block_size = max(1, BLOCK_ELEMENTS // max(n_users, 1))
+        for start in range(0, n_movies, block_size):
+            stop = min(start + block_size, n_movies)
+            low, high = np.searchsorted(sorted_columns, [start, stop])
+            if low == high:
+                continue
+            entries = by_column[low:high]
+            block = np.zeros((n_users, stop - start))
+            block[rows[entries], self.indices[entries] - start] = self.data[entries]
+            similarity += block @ block.T
+
+        denominators = norms[:, None] * norms[None, :]
+        np.divide(similarity, denominators, out=similarity, where=denominators > 0)
+        similarity[denominators == 0] = 0
+        np.fill_diagonal(similarity, 0)
+        return similarity
@@ -0,0 +1,76 @@
+"""
+Measures the rows per second of the TMDB dataset ingestion on a local CSV file: parsing and
+validating the file in chunks, and inserting the movies and their genres into a temporary SQLite database.
+Without --csv, a file is generated by repeating the rows of the test fixture.
+
+Usage: python -m benchmarks.bench_ingest --rows 200000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from dataset.bulk import POPULATE_BATCH_SIZE
+from dataset.movies import read_movie_chunks, read_movies, insert_movies, CSV_CHUNK_SIZE
+from models.base import Base
+
+FIXTURE_CSV = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures", "tmdb_movies.csv")
+
+
+def generate_csv(path, n_rows):
+    """
+    Writes a dataset file with n_rows rows, repeating the fixture rows with unique ids.
+    """
+    with open(FIXTURE_CSV, newline="", encoding="utf-8") as fixture:
+        reader = csv.reader(fixture)
+        header = next(reader)
+        rows = list(reader)
+
+    imdb_index = header.index("imdb_id")
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for number in range(n_rows):
+            row = list(rows[number % len(rows)])
+            if row[imdb_index]:
+                row[imdb_index] = f"tt{number:08d}"
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", help="Dataset file to read, generated from the fixture when omitted")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows of the generated file")
+    parser.add_argument("--chunk-size", type=int, default=CSV_CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=POPULATE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = args.csv
+        if csv_path is None:
+            csv_path = os.path.join(directory, "movies.csv")
+            generate_csv(csv_path, args.rows)
+        print(f"{csv_path}: {os.path.getsize(csv_path) / 2 ** 20:.1f}MB")
+
+        start = time.perf_counter()
+        valid = sum(len(chunk) for chunk in read_movie_chunks(csv_path, args.chunk_size))
+        elapsed = time.perf_counter() - start
+        print(f"parse and validate  {valid} valid movies in {elapsed:.2f}s, {valid / elapsed:,.0f} rows/s")
+
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with sessionmaker(bind=engine)() as db:
+            start = time.perf_counter()
+            movies = read_movies(csv_path, max_movies=0, chunk_size=args.chunk_size)
+            inserted = insert_movies(db, movies, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - start
+        engine.dispose()
+        print(f"ingest into sqlite  {inserted} movies in {elapsed:.2f}s, {inserted / elapsed:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
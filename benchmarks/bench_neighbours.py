@@ -0,0 +1,79 @@
+"""
+Compares the approximate LSH neighbour index against the exact similarity matrix on
+synthetic ratings: build time, query latency and recall of the top-k neighbours.
+
+Usage: python -m benchmarks.bench_neighbours --users 5000 --movies 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from algorithm.lsh import LshNeighbourIndex
+from algorithm.neighbours import NeighbourIndex
+from algorithm.sparse import RatingMatrix
+
+
+def generate_ratings(n_users, n_movies, ratings_per_user, n_clusters, seed=0):
+    """
+    Generates ratings where every user mostly rates movies of one taste cluster,
+    so that users have meaningful nearest neighbours.
+    """
+    rng = np.random.default_rng(seed)
+    movie_clusters = rng.integers(0, n_clusters, n_movies)
+    user_ids, movie_ids, ratings = [], [], []
+    for user_id in range(n_users):
+        cluster_movies = np.flatnonzero(movie_clusters == rng.integers(0, n_clusters))
+        own = rng.choice(cluster_movies, size=min(len(cluster_movies), ratings_per_user * 3 // 4), replace=False)
+        other = rng.choice(n_movies, size=ratings_per_user - len(own), replace=False)
+        movies = np.unique(np.concatenate([own, other]))
+        user_ids.append(np.full(len(movies), user_id))
+        movie_ids.append(movies)
+        ratings.append(rng.integers(1, 6, len(movies)))
+    return np.concatenate(user_ids), np.concatenate(movie_ids), np.concatenate(ratings)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--ratings-per-user", type=int, default=50)
+    parser.add_argument("--clusters", type=int, default=20)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    matrix = RatingMatrix.from_ratings(*generate_ratings(args.users, args.movies, args.ratings_per_user, args.clusters))
+    norms = matrix.row_norms()
+    print(f"{matrix.shape[0]} users, {matrix.shape[1]} movies, {matrix.nnz} ratings")
+
+    exact, exact_build = timed(NeighbourIndex, matrix, norms)
+    lsh, lsh_build = timed(LshNeighbourIndex, matrix, norms)
+    print(f"build   exact {exact_build:8.3f}s   lsh {lsh_build:8.3f}s "
+          f"({lsh.tables} tables x {lsh.bits} bits)")
+
+    queries = np.random.default_rng(1).choice(matrix.shape[0], size=min(args.queries, matrix.shape[0]), replace=False)
+    exact_time = lsh_time = 0.0
+    hits = 0
+    for user_index in queries:
+        # Bypass the exact index' cache, so every query pays for its own selection
+        (expected, _), elapsed = timed(exact._select, user_index, args.k)
+        exact_time += elapsed
+        (found, _), elapsed = timed(lsh.neighbours, user_index, args.k)
+        lsh_time += elapsed
+        hits += len(np.intersect1d(expected, found))
+
+    print(f"query   exact {exact_time / len(queries) * 1000:8.3f}ms  lsh {lsh_time / len(queries) * 1000:8.3f}ms")
+    print(f"recall@{args.k} {hits / (len(queries) * args.k):.3f}")
+    print(f"memory  exact {exact.similarity_matrix.nbytes / 2 ** 20:8.1f}MB  "
+          f"lsh {(lsh._planes.nbytes + lsh._keys.nbytes) / 2 ** 20:8.1f}MB (excluding buckets)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import os
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from alembic import command
 
@@ -11,10 +13,50 @@ load_dotenv()
 # Get database url with dotenv
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test_db.db")
 
-# Define engine and session
-engine = create_engine(DATABASE_URL)
+# Connections kept open per engine and process, and connections opened beyond that under load
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, -1 keeps connections open indefinitely
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+# Test connections before using them, so connections dropped by the server are replaced
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+
+# Drivers of the async engine, by the dialect of DATABASE_URL
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_database_url(url: str):
+    """
+    Converts a database URL to the same database with an async driver.
+    """
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}") \
+        .render_as_string(hide_password=False)
+
+# Database url of the async engine, derived from DATABASE_URL unless it is set
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+def pool_options(url: str):
+    """
+    Returns the connection pool options of an engine. SQLite connections are local files that
+    are cheap to open, so async SQLite engines open one per session and aren't sized.
+    """
+    options = {"pool_recycle": DATABASE_POOL_RECYCLE, "pool_pre_ping": DATABASE_POOL_PRE_PING}
+    if make_url(url).drivername != "sqlite+aiosqlite":
+        options.update(pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW,
+                       pool_timeout=DATABASE_POOL_TIMEOUT)
+    return options
+
+# Define engine and session, used by the recommender, the exports and the dataset populators
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Define async engine and session, used by the routers so queries don't block the event loop.
+# Objects aren't expired on commit, because expired attributes can't be lazy loaded in async code.
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Function to get database session
 def get_db():
     db = SessionLocal()
@@ -22,3 +64,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Function to get async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,115 @@
+import csv
+import io
+import os
+import time
+from itertools import islice
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# Rows inserted per statement and transaction by the populators
+POPULATE_BATCH_SIZE = int(os.getenv("POPULATE_BATCH_SIZE", "5000"))
+# Seconds between progress reports of the populators
+POPULATE_PROGRESS_INTERVAL = float(os.getenv("POPULATE_PROGRESS_INTERVAL", "5"))
+
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class ProgressReporter:
+    """
+    Prints the progress of a long running job at most once per interval, instead of once per row.
+    """
+
+    def __init__(self, name, total=None, interval=POPULATE_PROGRESS_INTERVAL):
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def update(self, count):
+        """
+        Adds to the number of processed rows, and prints the progress if the interval has passed.
+        """
+        self.count += count
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0
+        progress = f"{self.count}/{self.total} ({self.count / self.total * 100:.2f}%)" if self.total else self.count
+        print(f"Processed {progress} {self.name}, {rate:.0f} rows/s")
+
+
+def bulk_insert(db: Session, model, rows, batch_size: int = POPULATE_BATCH_SIZE, ignore_conflicts: bool = False,
+                total: int = None):
+    """
+    Inserts rows in batches, with one statement and one commit per batch.
+    :param model: The model class of the table.
+    :param rows: Iterable of dicts with the column values of every row, which may be a generator.
+    :param ignore_conflicts: Skip rows that violate a unique constraint with ON CONFLICT DO NOTHING,
+        instead of failing the batch.
+    :param total: The number of rows, if known, for the progress reports.
+    :return: The number of inserted rows.
+    """
+    progress = ProgressReporter(model.__tablename__, total)
+    rows = iter(rows)
+    inserted = 0
+    while batch := list(islice(rows, batch_size)):
+        inserted += insert_batch(db, model, batch, ignore_conflicts)
+        db.commit()
+        progress.update(len(batch))
+    progress.report()
+    return inserted
+
+
+def insert_batch(db: Session, model, batch, ignore_conflicts: bool = False):
+    """
+    Inserts a batch with COPY on Postgres when conflicts don't have to be handled, as COPY has
+    no ON CONFLICT clause, and with a multi-row INSERT otherwise. The batch isn't committed.
+    :return: The number of inserted rows.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql" and not ignore_conflicts:
+        return _copy_batch(db, model, batch)
+
+    # Only the rows that were inserted are returned, so skipped conflicts aren't counted
+    return len(insert_returning(db, model, batch, model.__table__.primary_key.columns, ignore_conflicts))
+
+
+def insert_returning(db: Session, model, batch, columns, ignore_conflicts: bool = False):
+    """
+    Inserts a batch with one multi-row INSERT and returns columns of the inserted rows, e.g.
+    the generated IDs. The batch isn't committed.
+    :param columns: The columns to return.
+    :param ignore_conflicts: Skip rows that violate a unique constraint, which are not returned.
+    :return: A list of rows with the returned columns.
+    """
+    dialect = db.get_bind().dialect.name
+    if ignore_conflicts and dialect in DIALECT_INSERTS:
+        statement = DIALECT_INSERTS[dialect](model).on_conflict_do_nothing()
+    else:
+        statement = insert(model)
+    return db.execute(statement.returning(*columns), batch).all()
+
+
+def _copy_batch(db: Session, model, batch):
+    columns = list(batch[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        # An unquoted empty field is NULL in COPY's CSV format
+        writer.writerow(["" if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    return len(batch)
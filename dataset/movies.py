@@ -1,20 +1,20 @@
 import os
 
 import kagglehub
+import pandas as pd
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from dtos.dtos import MovieBaseDto, GenreBaseDto
-from datetime import datetime
+from dataset.bulk import insert_batch, insert_returning, ProgressReporter, POPULATE_BATCH_SIZE
 from database import get_db
-from models.base import Genre, Movie
+from models.base import Genre, Movie, MovieGenre
 
-MAX_MOVIES = 1000
-COLUMN_NAMES = [
-    "id", "title", "vote_average", "vote_count", "status", "release_date", "revenue", "runtime", "adult",
-    "backdrop_path", "budget", "homepage", "imdb_id", "original_language", "original_title", "overview",
-    "popularity", "poster_path", "tagline", "genres", "production_companies", "production_countries",
-    "spoken_languages", "keywords",
-]
+# Maximum number of movies read from the dataset, 0 reads all of the ~930k movies
+MAX_MOVIES = int(os.getenv("POPULATE_MAX_MOVIES", "1000"))
+# Rows of the dataset file parsed and validated at once
+CSV_CHUNK_SIZE = int(os.getenv("POPULATE_CSV_CHUNK_SIZE", "50000"))
+# Columns of the dataset file that are imported
+MOVIE_COLUMNS = ["title", "release_date", "runtime", "imdb_id", "genres"]
 
 def populate_movies():
     """
@@ -37,125 +37,153 @@ def populate_movies():
         print("Invalid dataset file")
         return
 
-    print("Opening dataset file...")
-    file = open(f"{dataset_path}/{csv_file_name}", "r", encoding="utf-8")
-    lines = file.readlines()
-    file.close()
+    print("Processing movies...")
+    # Movies with an IMDB ID that already exists are skipped in bulk
+    movies = read_movies(f"{dataset_path}/{csv_file_name}")
+    count_added = insert_movies(db, movies)
 
-    title_index = COLUMN_NAMES.index("title")
-    release_date_index = COLUMN_NAMES.index("release_date")
-    runtime_index = COLUMN_NAMES.index("runtime")
-    imdb_id_index = COLUMN_NAMES.index("imdb_id")
-    genres_index = COLUMN_NAMES.index("genres")
+    print(f"Finished processing movies. Total added: {count_added}")
 
-    print("Processing movies...")
-    count_added = 0
+def read_movies(csv_path, max_movies=MAX_MOVIES, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Streams the valid movies of the dataset file chunk by chunk.
+    :param max_movies: Maximum number of movies to read, 0 reads all of them.
+    :return: A generator of DataFrames, see validate_movies().
+    """
+    count_read = 0
 
-    for index, line in enumerate(lines):
-        if index == 0:
-            continue
+    for chunk in read_movie_chunks(csv_path, chunk_size):
+        if max_movies:
+            chunk = chunk.head(max_movies - count_read)
 
-        if count_added >= MAX_MOVIES:
+        yield chunk
+        count_read += len(chunk)
+        if max_movies and count_read >= max_movies:
             break
 
-        columns = split_csv_line(line)
-        movie_title = columns[title_index]
-        movie_release_date = columns[release_date_index]
-        movie_runtime = int(columns[runtime_index])
-        movie_imdb_id = columns[imdb_id_index]
-        if len(movie_title) > 100:
-            print(f"Skipping movie {movie_title} because it has a title longer than 100 characters")
-            continue
-        if len(movie_release_date) != 10:
-            print(f"Skipping movie {movie_title} because it has an invalid release date")
-            continue
-        if movie_runtime < 1:
-            print(f"Skipping movie {movie_title} because it has no runtime")
-            continue
-        if movie_imdb_id == "":
-            print(f"Skipping movie {movie_title} because it has no IMDB ID")
-            continue
-
-        genres_str = columns[genres_index]
-        genres_data = genres_str.split(",")
-        genres_data = [genre.strip() for genre in genres_data]
-        genre_name = genres_data[0]
-        if genre_name == "":
-            print(f"Skipping movie {movie_title} because it has no genre")
-            continue
-
-        genre_id = None
-        if len(genres_data) > 0:
-            genre_id = get_or_create_genre_id(genre_name, db)
-
-        print(f"Processing movie {count_added}/{MAX_MOVIES} ({(count_added / MAX_MOVIES) * 100:.2f}%)")
-
-        movie = MovieBaseDto(
-            title=movie_title,
-            release_date=datetime.strptime(movie_release_date, "%Y-%m-%d"),
-            runtime=movie_runtime,
-            imdb_id=movie_imdb_id,
-            genre_id=genre_id,
-        )
-
-        if try_add_movie(movie, db):
-            count_added += 1
-
-    print("Finished processing movies")
-
-def try_add_movie(movie, db):
-    """
-    Tries to add a movie to the database.
-    :param movie: The movie to add.
-    :param db: The database session.
-    :return: True if the movie was added successfully, False otherwise.
-    """
-    try:
-        new_movie = Movie(**movie.model_dump())
-        db.add(new_movie)
-        db.commit()
-        return True
-    except Exception as e:
-        print(f"Failed to add movie {movie.title} to the database: {e}")
-        db.rollback()
-        return False
-
-def get_or_create_genre_id(genre_name: str, db: Session):
-    """
-    Gets the ID of a genre from the database, or creates a new genre if it doesn't exist.
-    :param genre_name: The name of the genre.
-    :param db: The database session.
-    :return: The ID of the genre.
-    """
-    genre = db.query(Genre).filter(Genre.name == genre_name).first()
-    if genre:
-        return genre.id
-
-    # Create new genre
-    new_genre = Genre(**GenreBaseDto(name=genre_name).model_dump())
-    db.add(new_genre)
+def insert_movies(db: Session, chunks, batch_size=POPULATE_BATCH_SIZE):
+    """
+    Inserts movies with all of their genres, one batch of movies and their genres per transaction.
+    The genre IDs are looked up in a map of all genres that is loaded once, and the missing
+    genres of every chunk are created with a single statement.
+    Movies with an IMDB ID that already exists are skipped.
+    :param chunks: Iterable of DataFrames returned by validate_movies().
+    :return: The number of inserted movies.
+    """
+    genre_ids = load_genre_ids(db)
+    progress = ProgressReporter(Movie.__tablename__)
+    count_added = 0
+
+    for chunk in chunks:
+        create_missing_genres(db, chunk["genres"].explode().unique(), genre_ids)
+        for start in range(0, len(chunk), batch_size):
+            batch = chunk.iloc[start:start + batch_size]
+            count_added += insert_movie_batch(db, batch, genre_ids)
+            db.commit()
+            progress.update(len(batch))
+
+    progress.report()
+    return count_added
+
+def insert_movie_batch(db: Session, batch, genre_ids):
+    """
+    Inserts a batch of movies, and the movie genres of the movies that were inserted.
+    :param batch: DataFrame returned by validate_movies().
+    :param genre_ids: Map of genre names to IDs, which must contain every genre of the batch.
+    :return: The number of inserted movies.
+    """
+    movies = batch[["title", "release_date", "runtime", "imdb_id"]].assign(
+        genre_id=batch["genres"].str[0].map(genre_ids))
+    inserted = insert_returning(db, Movie, movies.to_dict("records"), [Movie.imdb_id, Movie.id],
+                                ignore_conflicts=True)
+    movie_ids = dict(inserted)
+
+    movie_genres = [
+        {"movie_id": movie_ids[imdb_id], "genre_id": genre_ids[genre_name], "position": position}
+        for imdb_id, genre_names in zip(batch["imdb_id"], batch["genres"]) if imdb_id in movie_ids
+        for position, genre_name in enumerate(genre_names)
+    ]
+    if movie_genres:
+        insert_batch(db, MovieGenre, movie_genres)
+    return len(movie_ids)
+
+def read_movie_chunks(csv_path, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Reads the dataset file chunk by chunk, so the file is never held in memory as a whole, and
+    validates every chunk at once. Invalid movies are dropped and counted per reason.
+    Quoted fields may contain commas and newlines.
+    :return: A generator of DataFrames, see validate_movies().
+    """
+    chunks = pd.read_csv(csv_path, usecols=MOVIE_COLUMNS, dtype=str, keep_default_na=False,
+                         chunksize=chunk_size, encoding="utf-8")
+    for chunk in chunks:
+        yield validate_movies(chunk)
+
+def validate_movies(chunk):
+    """
+    Validates and converts a chunk of raw dataset rows, with the same rules as MovieBaseDto.
+    :param chunk: DataFrame with the raw MOVIE_COLUMNS as strings.
+    :return: DataFrame with the title, release_date, runtime and imdb_id of the valid movies,
+        and a genres column with the list of their genre names, primary genre first.
+    """
+    titles = chunk["title"]
+    release_dates = pd.to_datetime(chunk["release_date"], format="%Y-%m-%d", errors="coerce")
+    runtimes = pd.to_numeric(chunk["runtime"], errors="coerce")
+    imdb_ids = chunk["imdb_id"]
+    genres = chunk["genres"].map(split_genres)
+
+    checks = {
+        "a title that is empty or longer than 100 characters": titles.str.len().between(1, 100),
+        "an invalid release date": release_dates.notna(),
+        "no runtime": runtimes >= 1,
+        "no or an invalid IMDB ID": imdb_ids.str.len().between(1, 10),
+        "no genre": genres.str.len() > 0,
+    }
+    valid = pd.Series(True, index=chunk.index)
+    for reason, passed in checks.items():
+        skipped = valid & ~passed
+        if skipped.any():
+            print(f"Skipping {skipped.sum()} movies because they have {reason}")
+        valid &= passed
+
+    # The same movie may appear more than once in the dataset, duplicates in different
+    # chunks are skipped by the insert
+    valid &= ~imdb_ids.duplicated()
+
+    return pd.DataFrame({
+        "title": titles[valid],
+        "release_date": release_dates[valid].dt.date,
+        "runtime": runtimes[valid].astype(int),
+        "imdb_id": imdb_ids[valid],
+        "genres": genres[valid],
+    })
+
+def split_genres(genres: str):
+    """
+    Splits the comma separated genres of a dataset row into a list of unique genre names, in
+    their original order. Names that are too long for a genre are left out, like GenreBaseDto.
+    """
+    names = (name.strip() for name in genres.split(","))
+    return list(dict.fromkeys(name for name in names if 0 < len(name) <= 50))
+
+def load_genre_ids(db: Session):
+    """
+    Loads all genres of the database.
+    :return: A dict of genre names to IDs.
+    """
+    return dict(db.execute(select(Genre.name, Genre.id)).all())
+
+def create_missing_genres(db: Session, genre_names, genre_ids):
+    """
+    Creates the genres that aren't in genre_ids yet with one statement, and adds their IDs to it.
+    Genres that were created concurrently are skipped by the insert and looked up instead.
+    :param genre_names: The genre names that must exist.
+    :param genre_ids: Map of genre names to IDs, updated in place.
+    """
+    missing = [name for name in genre_names if name not in genre_ids]
+    if not missing:
+        return
+
+    insert_returning(db, Genre, [{"name": name} for name in missing], [Genre.id], ignore_conflicts=True)
     db.commit()
-    db.refresh(new_genre)
-
-    # Return genre ID
-    return new_genre.id
-
-def split_csv_line(line):
-    """
-    Splits a CSV line into columns.
-    :param line: The line to split.
-    :return: A list of columns.
-    """
-    data = []
-    column = ""
-    in_quotes = False
-    for char in line:
-        if char == "," and not in_quotes:
-            data.append(column)
-            column = ""
-        elif char == "\"":
-            in_quotes = not in_quotes
-        else:
-            column += char
-
-    return data
+    genre_ids.update(db.execute(select(Genre.name, Genre.id).where(Genre.name.in_(missing))).all())
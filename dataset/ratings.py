@@ -1,7 +1,9 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import date, timedelta
 import random
 
+from dataset.bulk import bulk_insert
 from models.base import Rating, User, Movie
 from database import get_db
 
@@ -43,8 +45,8 @@ def populate_ratings():
         return
 
     print("Fetching existing users and movies...")
-    user_ids = [u.id for u in db.query(User).all()]
-    movie_ids = [m.id for m in db.query(Movie).all()]
+    user_ids = db.scalars(select(User.id)).all()
+    movie_ids = db.scalars(select(Movie.id)).all()
 
     if not user_ids or not movie_ids:
         print("No users or movies found in the database. Cannot generate ratings.")
@@ -54,25 +56,6 @@ def populate_ratings():
     random_ratings = generate_random_ratings(user_ids, movie_ids, count=50000)
 
     print("Processing ratings...")
-    count_added = 0
-
-    for rating_data in random_ratings:
-        if try_add_rating(rating_data, db):
-            count_added += 1
+    count_added = bulk_insert(db, Rating, random_ratings, total=len(random_ratings))
 
     print(f"Finished processing ratings. Total added: {count_added}")
-
-def try_add_rating(rating_data, db):
-    """
-    Tries to add a rating to the database.
-    """
-    try:
-        new_rating = Rating(**rating_data)
-        db.add(new_rating)
-        db.commit()
-        print(f"Added rating for movie {rating_data['movie_id']} by user {rating_data['user_id']}")
-        return True
-    except Exception as e:
-        print(f"Failed to add rating: {e}")
-        db.rollback()
-        return False
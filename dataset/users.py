@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 
+from dataset.bulk import bulk_insert
 from dtos.dtos import UserBaseDto
 from models.base import User
 from database import get_db
@@ -39,27 +40,8 @@ def populate_users():
     test_users = generate_test_users(count=100)
 
     print("Processing users...")
-    count_added = 0
-
-    for user_data in test_users:
-        user = UserBaseDto(**user_data)
-
-        if try_add_user(user, db):
-            count_added += 1
+    # Users that already exist are skipped in bulk instead of failing one by one
+    rows = (UserBaseDto(**user_data).model_dump() for user_data in test_users)
+    count_added = bulk_insert(db, User, rows, ignore_conflicts=True, total=len(test_users))
 
     print(f"Finished processing users. Total added: {count_added}")
-
-def try_add_user(user, db):
-    """
-    Tries to add a user to the database.
-    """
-    try:
-        new_user = User(**user.model_dump())
-        db.add(new_user)
-        db.commit()
-        print(f"Added user {user.username}")
-        return True
-    except Exception as e:
-        print(f"Failed to add user {user.username}: {e}")
-        db.rollback()
-        return False
@@ -36,4 +36,53 @@ class RatingBaseDto(BaseDto):
     date: Optional[datetime] = Field(default=None, description="Date of the rating")
 
 class RatingDto(RatingBaseDto):
-    id: Optional[int] = Field(default=None, description="Unique identifier for the rating")
\ No newline at end of file
+    id: Optional[int] = Field(default=None, description="Unique identifier for the rating")
+
+class RatingUpsertDto(BaseDto):
+    rating: int = Field(ge=0, le=5, description="Rating for the movie (1-5)")
+    date: Optional[datetime] = Field(default=None, description="Date of the rating, today when omitted")
+
+class BatchErrorDto(BaseDto):
+    index: int = Field(description="Position of the failed item in the batch")
+    detail: str = Field(description="Reason the item failed")
+
+class RatingBatchDto(BaseDto):
+    created: list[RatingDto] = Field(description="The created ratings, in the order of the batch")
+    errors: list[BatchErrorDto] = Field(description="The items that were not created")
+
+class RatingBatchDeleteDto(BaseDto):
+    deleted: list[int] = Field(description="IDs of the deleted ratings")
+    errors: list[BatchErrorDto] = Field(description="The IDs that were not deleted")
+
+class RecommendedMovieDto(MovieDto):
+    score: float = Field(description="Predicted score of the movie for the user")
+
+class NeighbourDto(BaseDto):
+    user_id: int = Field(description="User ID of the similar user")
+    similarity: float = Field(description="Cosine similarity between the ratings of both users")
+
+class RecommenderStatusDto(BaseDto):
+    version: Optional[int] = Field(default=None, description="Version of the current model, None if it isn't built yet")
+    built_at: Optional[datetime] = Field(default=None, description="When the current model was built")
+    build_duration: Optional[float] = Field(default=None, description="Seconds it took to build the current model")
+    age: Optional[float] = Field(default=None, description="Seconds since the current model was built")
+    dirty_ratings: int = Field(default=0, description="Rating changes applied to the model since it was built")
+    rebuilding: bool = Field(default=False, description="Whether a rebuild is in progress")
+    last_error: Optional[str] = Field(default=None, description="Error of the last failed rebuild")
+    cache_size: int = Field(default=0, description="Recommendation lists in the result cache")
+    cache_hits: int = Field(default=0, description="Recommendation requests served from the result cache")
+    cache_misses: int = Field(default=0, description="Recommendation requests that had to be computed")
+    cache_evictions: int = Field(default=0, description="Lists evicted from the result cache because it was full or they expired")
+    cache_invalidations: int = Field(default=0, description="Lists dropped from the result cache because ratings changed")
+    feed_queues: int = Field(default=0, description="Users with a feed queue in memory")
+    feed_refills: int = Field(default=0, description="Feed queues filled with newly ranked candidates")
+    feed_evictions: int = Field(default=0, description="Feed queues dropped because too many users had one")
+
+class RecommendationBatchDto(BaseDto):
+    user_ids: list[int] = Field(min_length=1, max_length=10000, description="User IDs to recommend movies for")
+    k: int = Field(default=5, ge=1, le=100, description="Number of similar users to predict from")
+    top_n: int = Field(default=5, ge=1, le=100, description="Number of movies to recommend per user")
+
+class UserRecommendationsDto(BaseDto):
+    user_id: int = Field(description="User ID the movies are recommended for")
+    movies: list[RecommendedMovieDto] = Field(description="Recommended movies with their predicted score, best first")
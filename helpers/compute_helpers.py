@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+# Threads computing recommendations. NumPy releases the GIL in its heavy loops, and a thread
+# pool can share the in-memory model, which a process pool would have to copy.
+COMPUTE_WORKERS = int(os.getenv("RECOMMENDER_COMPUTE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Jobs allowed to wait for a free thread before new jobs are rejected
+COMPUTE_QUEUE_DEPTH = int(os.getenv("RECOMMENDER_COMPUTE_QUEUE_DEPTH", "16"))
+RETRY_AFTER_SECONDS = 1
+# Seconds between attempts of jobs that wait for a free slot
+WAIT_POLL_SECONDS = 0.05
+
+_executor = None
+# Single thread that applies changes to the shared model, one at a time in submission order
+_update_executor = None
+_executor_lock = threading.Lock()
+# One slot per job that is running or waiting
+_slots = threading.BoundedSemaphore(COMPUTE_WORKERS + COMPUTE_QUEUE_DEPTH)
+
+
+async def run_in_pool(function, *args):
+    """
+    Helper function that runs a CPU heavy function on the bounded compute pool, so it
+    doesn't block the event loop and other requests of the worker.
+    Raises a 503 when every thread is busy and the queue is full.
+    """
+    future = _submit(function, *args)
+    if future is None:
+        raise HTTPException(status_code=503, detail="Too many recommendation requests, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return await asyncio.wrap_future(future)
+
+
+async def wait_in_pool(function, *args):
+    """
+    Helper function that runs a CPU heavy function on the bounded compute pool like run_in_pool(),
+    but waits for a free slot instead of raising a 503, e.g. for the later chunks of a response
+    that is already being streamed.
+    """
+    future = _submit(function, *args)
+    while future is None:
+        await asyncio.sleep(WAIT_POLL_SECONDS)
+        future = _submit(function, *args)
+    return await asyncio.wrap_future(future)
+
+
+async def run_model_update(function, *args):
+    """
+    Helper function that applies a change to the shared recommender model on the model update
+    thread, so waiting for the model lock and recomputing similarities doesn't block the event
+    loop. Changes are applied in the order they were submitted. They are never rejected,
+    because the database already holds them.
+    """
+    global _update_executor
+    with _executor_lock:
+        if _update_executor is None:
+            _update_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommender-update")
+        future = _update_executor.submit(function, *args)
+    return await asyncio.wrap_future(future)
+
+
+def submit_to_pool(function, *args):
+    """
+    Helper function that runs a function on the compute pool in the background, without waiting
+    for it, e.g. to prepare the data of later requests. Errors of the function are printed.
+    :return: Whether the job was submitted, which it isn't when the pool is saturated.
+    """
+    def background_job():
+        try:
+            function(*args)
+        except Exception as err:
+            print(f"Background job {getattr(function, '__name__', function)} failed: {err}")
+
+    return _submit(background_job) is not None
+
+
+def _submit(function, *args):
+    """
+    Submits a job if a slot is free.
+    :return: The future of the job, or None when every thread is busy and the queue is full.
+    """
+    if not _slots.acquire(blocking=False):
+        return None
+
+    def job():
+        # The slot is released when the job is done, even if the client went away before
+        try:
+            return function(*args)
+        finally:
+            _slots.release()
+
+    try:
+        return _get_executor().submit(job)
+    except RuntimeError:
+        _slots.release()
+        raise
+
+
+def shutdown_pool():
+    """
+    Helper function that waits for the running jobs and stops the compute pool and the model
+    update thread.
+    """
+    global _executor, _update_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _update_executor is not None:
+            _update_executor.shutdown(wait=True)
+            _update_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="recommender")
+        return _executor
@@ -1,23 +1,52 @@
-from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, Response
+from pydantic import ValidationError
+from sqlalchemy import select, insert, delete, tuple_, UniqueConstraint
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-def get_all_entities(entity_class, db: Session):
+from dataset.bulk import DIALECT_INSERTS
+
+# Page size of the list endpoints when no limit is given, and the largest allowed limit
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Largest number of items of a batch request
+MAX_BATCH_SIZE = 1000
+
+async def get_page_of_entities(entity_class, db: AsyncSession, limit: int = DEFAULT_PAGE_SIZE, after_id: int = None,
+                               conditions: tuple = (), **filters):
     """
-    Helper function that retrieves all entities from the provided data.
+    Helper function that retrieves a page of entities ordered by ID, starting after the given ID.
+    Paging on the ID (keyset pagination) uses the primary key index, so every page is equally
+    fast, unlike an offset that has to skip over all previous rows.
+    Filters with a value of None are ignored, the others must match exactly.
+    :param conditions: Additional SQL expressions the entities must match.
     """
-    return db.query(entity_class).all()
+    statement = select(entity_class).where(*conditions)
+    if after_id is not None:
+        statement = statement.where(entity_class.id > after_id)
+    for field, value in filters.items():
+        if value is not None:
+            statement = statement.where(getattr(entity_class, field) == value)
+    return (await db.scalars(statement.order_by(entity_class.id).limit(limit))).all()
 
-def get_entity(entity_class, entity_id: int, db: Session):
+def set_next_cursor(response: Response, entities: list, limit: int):
+    """
+    Helper function that sets the X-Next-Cursor header to the ID to pass as after_id for the next
+    page. A page that isn't full is the last one and gets no header.
+    """
+    if len(entities) == limit:
+        response.headers["X-Next-Cursor"] = str(entities[-1].id)
+
+async def get_entity(entity_class, entity_id: int, db: AsyncSession):
     """
     Helper function that retrieves an entity from the provided data by its ID.
     """
-    entity = db.get(entity_class, entity_id)
+    entity = await db.get(entity_class, entity_id)
     if not entity:
         raise HTTPException(status_code=404, detail="Entity not found")
     return entity
 
-def create_or_rollback(entity_class, entity_data: dict, db: Session):
+async def create_or_rollback(entity_class, entity_data: dict, db: AsyncSession):
     """
     Helper function to create an entity in the database using the provided data.
     Some classes include foreign keys, which may raise exceptions in some cases.
@@ -27,27 +56,27 @@ def create_or_rollback(entity_class, entity_data: dict, db: Session):
     for field, value in entity_data.items():
         expect_type = getattr(entity_class, field).type.python_type
         if not isinstance(value, expect_type) and value is not None:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=400, detail=f"Invalid type input: Field {field} must be of type {expect_type}")
 
     try:
         db.add(new_entity)
-        db.commit()
-        db.refresh(new_entity)
+        await db.commit()
+        await db.refresh(new_entity)
     except IntegrityError as err:
-        db.rollback()
+        await db.rollback()
         if "foreign key constraint" in str(err.orig).lower():
             raise HTTPException(status_code=400, detail="Invalid foreign key value")
         raise HTTPException(status_code=400, detail="Database constraint error")
     except KeyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Invalid field: {str(err)}")
     except Exception as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(err))
     return new_entity
 
-def update_or_rollback(instance: object, updates: dict, db: Session):
+async def update_or_rollback(instance: object, updates: dict, db: AsyncSession):
     """
     Helper function that updates an entity from the provided data by its ID.
     Some classes include foreign keys, which may raise exceptions in some cases.
@@ -58,36 +87,156 @@ def update_or_rollback(instance: object, updates: dict, db: Session):
     for key,value in updates.items():
         expect_type = getattr(instance.__class__, key).type.python_type
         if not isinstance(value, expect_type) and value is not None:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=400, detail=f"Invalid type input: Key {key} must be of type {expect_type}")
         setattr(instance, key, value)
 
     try:
-        db.commit()
-        db.refresh(instance)
+        await db.commit()
+        await db.refresh(instance)
     except IntegrityError as err:
-        db.rollback()
+        await db.rollback()
         if "foreign key constraint" in str(err.orig).lower():
             raise HTTPException(status_code=400, detail="Invalid foreign key value")
         raise HTTPException(status_code=400, detail="Database constraint error")
     except KeyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Invalid field: {str(err)}")
     except Exception as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(err))
     return instance
 
-def delete_or_rollback(instance: object, db: Session):
+async def delete_or_rollback(instance: object, db: AsyncSession):
     """
     Helper function that deletes an entity by its ID.
     """
     try:
-        db.delete(instance)
-        db.commit()
+        await db.delete(instance)
+        await db.commit()
     except Exception:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="An error occurred while deleting")
 
+async def upsert_entity(entity_class, entity_data: dict, index_elements: list[str], db: AsyncSession):
+    """
+    Helper function that creates an entity, or updates the existing entity with the same values
+    for the columns of a unique index, with a single INSERT ... ON CONFLICT DO UPDATE.
+    :param index_elements: The columns of the unique index.
+    :return: The created or updated entity.
+    """
+    insert_class = DIALECT_INSERTS[db.get_bind().dialect.name]
+    statement = insert_class(entity_class).values(**entity_data)
+    updates = {field: value for field, value in entity_data.items() if field not in index_elements}
+    statement = statement.on_conflict_do_update(index_elements=index_elements, set_=updates) \
+        .returning(entity_class).execution_options(populate_existing=True)
+    try:
+        entity = await db.scalar(statement)
+        await db.commit()
+    except IntegrityError as err:
+        await db.rollback()
+        if "foreign key constraint" in str(err.orig).lower():
+            raise HTTPException(status_code=400, detail="Invalid foreign key value")
+        raise HTTPException(status_code=400, detail="Database constraint error")
+    return entity
 
+def unique_column_sets(table):
+    """
+    Returns the columns of every unique index and unique constraint of a table, except the primary key.
+    """
+    column_sets = [list(index.columns) for index in table.indexes if index.unique]
+    column_sets += [list(constraint.columns) for constraint in table.constraints
+                    if isinstance(constraint, UniqueConstraint)]
+    column_sets += [[column] for column in table.columns if column.unique]
+    # Deduplicated by column names, because comparing columns builds SQL expressions
+    return list({tuple(column.name for column in columns): columns for columns in column_sets}.values())
+
+async def create_batch(entity_class, dto_class, items: list[dict], db: AsyncSession, required: tuple = ()):
+    """
+    Helper function that validates a batch of entities and creates the valid ones with a single
+    INSERT in one transaction. Invalid items, items with a foreign key that doesn't exist and
+    items that duplicate an existing entity or an earlier item on a unique index are reported
+    instead of failing the whole batch.
+    :param dto_class: The DTO every item is validated with.
+    :param required: Fields that must not be empty.
+    :return: A tuple (created entities, errors), where errors is a list of (index, detail) tuples.
+    """
+    rows, indexes, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            data = dto_class.model_validate(item).model_dump()
+        except ValidationError as err:
+            error = err.errors()[0]
+            errors.append((index, f"Invalid field {'.'.join(map(str, error['loc']))}: {error['msg']}"))
+            continue
+        missing = [field for field in required if data.get(field) is None]
+        if missing:
+            errors.append((index, f"Missing field: {missing[0]}"))
+            continue
+        rows.append(data)
+        indexes.append(index)
+
+    # Foreign keys are checked with one query per referenced table instead of one per item
+    for column in entity_class.__table__.columns:
+        for foreign_key in column.foreign_keys:
+            values = {row[column.key] for row in rows if row.get(column.key) is not None}
+            if not values:
+                continue
+            existing = set(await db.scalars(select(foreign_key.column).where(foreign_key.column.in_(values))))
+            invalid = {position for position, row in enumerate(rows)
+                       if row.get(column.key) is not None and row[column.key] not in existing}
+            errors.extend((indexes[position], "Invalid foreign key value") for position in invalid)
+            rows = [row for position, row in enumerate(rows) if position not in invalid]
+            indexes = [index for position, index in enumerate(indexes) if position not in invalid]
+
+    # Unique indexes are checked with one query per index, against existing rows and earlier items
+    for columns in unique_column_sets(entity_class.__table__):
+        keys = [tuple(row.get(column.key) for column in columns) for row in rows]
+        values = {key for key in keys if None not in key}
+        if not values:
+            continue
+        existing = set(map(tuple, await db.execute(select(*columns).where(tuple_(*columns).in_(values)))))
+        seen, invalid = {}, set()
+        for position, key in enumerate(keys):
+            if None in key:
+                continue
+            if key in existing:
+                errors.append((indexes[position], "Duplicate of an existing entity"))
+                invalid.add(position)
+            elif key in seen:
+                errors.append((indexes[position], f"Duplicate of item {indexes[seen[key]]}"))
+                invalid.add(position)
+            else:
+                seen[key] = position
+        rows = [row for position, row in enumerate(rows) if position not in invalid]
+        indexes = [index for position, index in enumerate(indexes) if position not in invalid]
+
+    created = []
+    if rows:
+        try:
+            statement = insert(entity_class).returning(entity_class, sort_by_parameter_order=True)
+            created = (await db.scalars(statement, rows)).all()
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Database constraint error")
+    return created, sorted(errors)
+
+async def delete_batch(entity_class, entity_ids: list[int], db: AsyncSession):
+    """
+    Helper function that deletes a batch of entities by their IDs with a single DELETE in one
+    transaction. IDs that don't exist are reported instead of failing the whole batch.
+    :return: A tuple (deleted entities, errors), where errors is a list of (index, detail) tuples.
+    """
+    try:
+        statement = delete(entity_class).where(entity_class.id.in_(set(entity_ids))).returning(entity_class) \
+            .execution_options(synchronize_session=False)
+        deleted = (await db.scalars(statement)).all()
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="An error occurred while deleting")
 
+    deleted_ids = {entity.id for entity in deleted}
+    errors = [(index, "Entity not found") for index, entity_id in enumerate(entity_ids) if entity_id not in deleted_ids]
+    return deleted, errors
@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+import os
+from datetime import date
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+
+# Rows fetched per round trip and written per chunk of the response
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_response(statement, export_format: str, filename: str, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Helper function that streams the rows of a select statement as NDJSON or CSV, with one
+    object or line per row. The rows are read from a server-side cursor chunk by chunk while
+    the response is sent, so memory use doesn't grow with the size of the table.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid export format: {export_format}")
+
+    return StreamingResponse(
+        generate_export(statement, export_format, chunk_size),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'},
+    )
+
+
+def generate_export(statement, export_format: str, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Helper function that yields the serialised rows of a select statement, one chunk at a time.
+    It opens its own session, because the session of the request is closed before the response
+    is streamed.
+    """
+    with SessionLocal() as db:
+        result = db.execute(statement.execution_options(yield_per=chunk_size))
+        columns = list(result.keys())
+        if export_format == "csv":
+            yield _csv_lines([columns])
+
+        for rows in result.partitions():
+            if export_format == "csv":
+                yield _csv_lines(rows)
+            else:
+                yield "".join(json.dumps(dict(zip(columns, row)), default=_json_value) + "\n" for row in rows)
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _json_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
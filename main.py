@@ -1,18 +1,41 @@
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
-from routers import genres, movies, users, ratings, actions
+from algorithm import recommender
+from algorithm.scheduler import scheduler
+from database import async_engine
+from helpers.compute_helpers import shutdown_pool
+from routers import genres, movies, users, ratings, actions, recommendations
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the latest snapshot, or build the recommender model, once at startup instead of on
+    # the first request
+    snapshot_model = recommender.load_latest_snapshot()
+    if snapshot_model is None:
+        recommender.get_model()
+    scheduler.start()
+    if snapshot_model is not None:
+        # The snapshot lacks the ratings written since it was taken, so catch up in the background
+        scheduler.request_rebuild()
+    yield
+    scheduler.stop()
+    shutdown_pool()
+    await async_engine.dispose()
+
 # Create FastAPI instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(genres.router)
 app.include_router(users.router)
 app.include_router(movies.router)
 app.include_router(ratings.router)
 app.include_router(actions.router)
+app.include_router(recommendations.router)
 
 @app.get("/")
 async def root():
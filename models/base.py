@@ -1,5 +1,5 @@
 from sqlalchemy.orm import DeclarativeBase, relationship
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Index
 
 class Base(DeclarativeBase):
     pass
@@ -11,10 +11,19 @@ class Movie(Base):
     release_date = Column(Date)
     runtime = Column(Integer)
     imdb_id = Column(String, unique=True)
-    genre_id = Column(Integer, ForeignKey('genres.id'))
+    genre_id = Column(Integer, ForeignKey('genres.id'), index=True)
 
     genre = relationship('Genre', back_populates='movies')
     ratings = relationship('Rating', back_populates='movie')
+    # Deleted with the movie, by the ORM and by the database where foreign keys are enforced
+    movie_genres = relationship('MovieGenre', cascade='all, delete-orphan')
+
+class MovieGenre(Base):
+    __tablename__ = 'movie_genres'
+    movie_id = Column(Integer, ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True)
+    genre_id = Column(Integer, ForeignKey('genres.id'), primary_key=True)
+    # Order of the genre in the dataset's genre list, the genre at position 0 is Movie.genre
+    position = Column(Integer, nullable=False)
 
 class Genre(Base):
     __tablename__ = 'genres'
@@ -25,8 +34,10 @@ class Genre(Base):
 
 class Rating(Base):
     __tablename__ = 'ratings'
+    # A user rates a movie at most once. The index also serves lookups of all ratings of a user.
+    __table_args__ = (Index('ix_ratings_user_id_movie_id', 'user_id', 'movie_id', unique=True),)
     id = Column(Integer, primary_key=True, autoincrement=True)
-    movie_id = Column(Integer, ForeignKey('movies.id'))
+    movie_id = Column(Integer, ForeignKey('movies.id'), index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     rating = Column(Integer, nullable=False)
     date = Column(Date, nullable=False)
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Response
 
+from algorithm import recommender
 from dataset import users, movies, ratings
 
 router = APIRouter(
@@ -8,8 +9,14 @@ router = APIRouter(
 )
 
 @router.get("/populate")
-async def populate_database():
+def populate_database():
+    """
+    Populate the database from the datasets and rebuild the recommender model from it.
+    Importing takes minutes, so this is a sync route that FastAPI runs on its thread pool
+    instead of the event loop.
+    """
     users.populate_users()
     movies.populate_movies()
     ratings.populate_ratings()
+    recommender.reset_model()
     return Response(status_code=201, content="Users, movies and ratings populated")
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, Response, Depends
-from sqlalchemy.orm import Session
+from typing import Optional
 
-from database import get_db
+from fastapi import APIRouter, HTTPException, Response, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
 from dtos.dtos import GenreDto, GenreBaseDto
-from helpers.database_helpers import delete_or_rollback, get_all_entities, get_entity, create_or_rollback, \
-    update_or_rollback
+from helpers.database_helpers import delete_or_rollback, get_entity, create_or_rollback, update_or_rollback, \
+    get_page_of_entities, set_next_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from models.base import Genre
 
 router = APIRouter(
@@ -13,30 +15,38 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=list[GenreDto])
-async def read_genres(db: Session = Depends(get_db)):
-    genres = get_all_entities(Genre, db)
+async def read_genres(response: Response,
+                      limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      after_id: Optional[int] = Query(default=None, description="ID of the last genre of the previous page"),
+                      db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of genres, ordered by ID. The X-Next-Cursor response header holds the after_id
+    of the next page.
+    """
+    genres = await get_page_of_entities(Genre, db, limit, after_id)
+    set_next_cursor(response, genres, limit)
     return [GenreDto.model_validate(genre) for genre in genres]
 
 @router.get("/{genre_id}", response_model=GenreDto)
-async def read_genre(genre_id: int, db: Session = Depends(get_db)):
-    genre = get_entity(Genre, genre_id, db)
+async def read_genre(genre_id: int, db: AsyncSession = Depends(get_async_db)):
+    genre = await get_entity(Genre, genre_id, db)
     return GenreDto.model_validate(genre)
 
 @router.post("/", status_code=201, response_model=GenreDto)
-async def create_genre(genre: GenreBaseDto, response: Response, db: Session = Depends(get_db)):
-    new_genre = create_or_rollback(Genre, genre.model_dump(), db)
+async def create_genre(genre: GenreBaseDto, response: Response, db: AsyncSession = Depends(get_async_db)):
+    new_genre = await create_or_rollback(Genre, genre.model_dump(), db)
     response.headers["Location"] = f"/genres/{new_genre.id}"
     return GenreDto.model_validate(new_genre)
 
 @router.patch("/{genre_id}", response_model=GenreDto)
-async def update_genre(genre_id: int, updated_genre: GenreBaseDto, db: Session = Depends(get_db)):
-    genre = get_entity(Genre, genre_id, db)
+async def update_genre(genre_id: int, updated_genre: GenreBaseDto, db: AsyncSession = Depends(get_async_db)):
+    genre = await get_entity(Genre, genre_id, db)
     updates = updated_genre.model_dump(exclude_none=True)
-    updated_genre_final = update_or_rollback(genre, updates, db)
+    updated_genre_final = await update_or_rollback(genre, updates, db)
     return GenreDto.model_validate(updated_genre_final)
 
 @router.delete("/{genre_id}")
-async def delete_genre(genre_id: int, db: Session = Depends(get_db)):
-    genre = get_entity(Genre,genre_id, db)
-    delete_or_rollback(genre, db)
+async def delete_genre(genre_id: int, db: AsyncSession = Depends(get_async_db)):
+    genre = await get_entity(Genre,genre_id, db)
+    await delete_or_rollback(genre, db)
     return {"message": f"Genre with ID {genre_id} has been deleted"}
\ No newline at end of file
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, HTTPException, Response
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Response, Query
 from fastapi.params import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 
-from database import get_db
+from algorithm import recommender
+from database import get_async_db
 from dtos.dtos import MovieDto, MovieBaseDto
-from helpers.database_helpers import delete_or_rollback, get_all_entities, get_entity, create_or_rollback, \
-    update_or_rollback
-from models.base import Movie
+from helpers.compute_helpers import run_model_update
+from helpers.export_helpers import export_response
+from helpers.database_helpers import delete_or_rollback, get_entity, create_or_rollback, update_or_rollback, \
+    get_page_of_entities, set_next_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models.base import Movie, MovieGenre
 
 router = APIRouter(
     prefix="/movies",
@@ -14,30 +21,78 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=list[MovieDto])
-async def read_movies(db: Session = Depends(get_db)):
-    movies = get_all_entities(Movie, db)
+async def read_movies(response: Response,
+                      limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      after_id: Optional[int] = Query(default=None, description="ID of the last movie of the previous page"),
+                      genre_id: Optional[int] = Query(default=None, description="Only movies of this genre"),
+                      db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of movies, ordered by ID. The X-Next-Cursor response header holds the after_id
+    of the next page.
+    """
+    movies = await get_page_of_entities(Movie, db, limit, after_id, genre_id=genre_id)
+    set_next_cursor(response, movies, limit)
     return [MovieDto.model_validate(movie) for movie in movies]
 
+@router.get("/export")
+async def export_movies(format: str = Query(default="ndjson", description="ndjson or csv")):
+    """
+    Export all movies as NDJSON or CSV, streamed from the database in chunks.
+    """
+    statement = select(Movie.id, Movie.title, Movie.release_date, Movie.runtime, Movie.imdb_id, Movie.genre_id) \
+        .order_by(Movie.id)
+    return export_response(statement, format, "movies")
+
 @router.get("/{movie_id}", response_model=MovieDto)
-async def read_movie(movie_id: int, db: Session = Depends(get_db)):
-    movie = get_entity(Movie,movie_id, db)
+async def read_movie(movie_id: int, db: AsyncSession = Depends(get_async_db)):
+    movie = await get_entity(Movie,movie_id, db)
     return MovieDto.model_validate(movie)
 
 @router.post("/", response_model=MovieDto)
-async def create_movie(movie: MovieDto, response: Response, db: Session = Depends(get_db)):
-    new_movie = create_or_rollback(Movie, movie.model_dump(), db)
+async def create_movie(movie: MovieDto, response: Response, db: AsyncSession = Depends(get_async_db)):
+    new_movie = await create_or_rollback(Movie, movie.model_dump(), db)
+    if new_movie.genre_id is not None:
+        await set_primary_genre(new_movie.id, new_movie.genre_id, db)
+    await apply_to_recommender(new_movie)
     response.headers["Location"] = f"/genres/{new_movie.id}"
     return MovieDto.model_validate(new_movie)
 
 @router.patch("/{movie_id}", response_model=MovieDto)
-async def update_movie(movie_id: int, updated_movie: MovieBaseDto, db: Session = Depends(get_db)):
-    movie = get_entity(Movie, movie_id, db)
+async def update_movie(movie_id: int, updated_movie: MovieBaseDto, db: AsyncSession = Depends(get_async_db)):
+    movie = await get_entity(Movie, movie_id, db)
     updates = updated_movie.model_dump(exclude_none=True)
-    updated_movie_final = update_or_rollback(movie, updates, db)
+    updated_movie_final = await update_or_rollback(movie, updates, db)
+    if "genre_id" in updates:
+        await set_primary_genre(movie_id, updates["genre_id"], db)
+    await apply_to_recommender(updated_movie_final)
     return MovieBaseDto.model_validate(updated_movie_final)
 
 @router.delete("/{movie_id}")
-async def delete_movie(movie_id: int, db: Session = Depends(get_db)):
-    movie = get_entity(Movie, movie_id, db)
-    delete_or_rollback(movie,db)
-    return {"detail": f"Movie with ID {movie_id} has been deleted"}
\ No newline at end of file
+async def delete_movie(movie_id: int, db: AsyncSession = Depends(get_async_db)):
+    movie = await get_entity(Movie, movie_id, db)
+    await delete_or_rollback(movie,db)
+    await run_model_update(recommender.remove_movie, movie_id)
+    return {"detail": f"Movie with ID {movie_id} has been deleted"}
+
+async def set_primary_genre(movie_id: int, genre_id: int, db: AsyncSession):
+    """
+    Makes a genre the first one of a movie's genre list, so the list stays in line with the
+    movie's genre_id. The previous primary genre is removed from the list, and the new one is
+    moved to the front if it was already in it.
+    """
+    try:
+        await db.execute(delete(MovieGenre).where(MovieGenre.movie_id == movie_id,
+                                                  or_(MovieGenre.position == 0, MovieGenre.genre_id == genre_id)))
+        await db.execute(insert(MovieGenre).values(movie_id=movie_id, genre_id=genre_id, position=0))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Invalid foreign key value")
+
+async def apply_to_recommender(movie: Movie):
+    """
+    Passes the details of a created or updated movie on to the recommender, so its
+    recommendations don't show outdated details until the next rebuild.
+    """
+    await run_model_update(recommender.update_movie, movie.id, movie.title, movie.release_date, movie.runtime,
+                           movie.genre_id, movie.imdb_id)
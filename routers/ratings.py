@@ -1,11 +1,18 @@
-from fastapi import APIRouter, HTTPException, Response
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Response, Query, Body
 from fastapi.params import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
-from dtos.dtos import RatingDto, RatingBaseDto
-from helpers.database_helpers import delete_or_rollback, get_all_entities, get_entity, create_or_rollback, \
-    update_or_rollback
+from algorithm import recommender
+from database import get_async_db
+from dtos.dtos import RatingDto, RatingBaseDto, RatingBatchDto, RatingBatchDeleteDto, BatchErrorDto
+from helpers.compute_helpers import run_model_update
+from helpers.export_helpers import export_response
+from helpers.database_helpers import delete_or_rollback, get_entity, create_or_rollback, update_or_rollback, \
+    get_page_of_entities, set_next_cursor, create_batch, delete_batch, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, \
+    MAX_BATCH_SIZE
 from models.base import Rating
 
 router = APIRouter(
@@ -14,30 +21,84 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=list[RatingDto])
-async def read_ratings(db: Session = Depends(get_db)):
-    ratings = get_all_entities(Rating, db)
+async def read_ratings(response: Response,
+                       limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       after_id: Optional[int] = Query(default=None, description="ID of the last rating of the previous page"),
+                       user_id: Optional[int] = Query(default=None, description="Only ratings of this user"),
+                       movie_id: Optional[int] = Query(default=None, description="Only ratings of this movie"),
+                       db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of ratings, ordered by ID. The X-Next-Cursor response header holds the after_id
+    of the next page.
+    """
+    ratings = await get_page_of_entities(Rating, db, limit, after_id, user_id=user_id, movie_id=movie_id)
+    set_next_cursor(response, ratings, limit)
     return [RatingDto.model_validate(rating) for rating in ratings]
 
+@router.get("/export")
+async def export_ratings(format: str = Query(default="ndjson", description="ndjson or csv")):
+    """
+    Export all ratings as NDJSON or CSV, streamed from the database in chunks.
+    """
+    statement = select(Rating.id, Rating.user_id, Rating.movie_id, Rating.rating, Rating.date).order_by(Rating.id)
+    return export_response(statement, format, "ratings")
+
+@router.post("/batch", response_model=RatingBatchDto)
+async def create_ratings(ratings: list[dict] = Body(max_length=MAX_BATCH_SIZE,
+                                                    description="Ratings in the shape of a RatingBaseDto"),
+                         db: AsyncSession = Depends(get_async_db)):
+    """
+    Create many ratings at once, e.g. all ratings of a swipe session, in one transaction.
+    Every rating is validated on its own, the valid ones are created and the invalid ones are
+    reported by their position in the batch. The recommender is updated once for the whole batch.
+    """
+    created, errors = await create_batch(Rating, RatingBaseDto, ratings, db,
+                                         required=("user_id", "movie_id", "rating", "date"))
+    await run_model_update(recommender.apply_changes,
+                           [(rating.user_id, rating.movie_id, rating.rating) for rating in created])
+    return RatingBatchDto(created=[RatingDto.model_validate(rating) for rating in created],
+                          errors=[BatchErrorDto(index=index, detail=detail) for index, detail in errors])
+
+@router.delete("/batch", response_model=RatingBatchDeleteDto)
+async def delete_ratings(rating_id: list[int] = Query(max_length=MAX_BATCH_SIZE, description="IDs of the ratings to delete"),
+                         db: AsyncSession = Depends(get_async_db)):
+    """
+    Delete many ratings at once in one transaction. IDs that don't exist are reported by
+    their position in the batch. The recommender is updated once for the whole batch.
+    """
+    deleted, errors = await delete_batch(Rating, rating_id, db)
+    await run_model_update(recommender.apply_changes, [(rating.user_id, rating.movie_id, None) for rating in deleted])
+    return RatingBatchDeleteDto(deleted=sorted(rating.id for rating in deleted),
+                                errors=[BatchErrorDto(index=index, detail=detail) for index, detail in errors])
+
 @router.get("/{rating_id}", response_model=RatingDto)
-async def read_rating(rating_id: int, db: Session = Depends(get_db)):
-    rating = get_entity(Rating, rating_id, db)
+async def read_rating(rating_id: int, db: AsyncSession = Depends(get_async_db)):
+    rating = await get_entity(Rating, rating_id, db)
     return RatingDto.model_validate(rating)
 
 @router.post("/", status_code=201, response_model=RatingDto)
-async def create_rating(rating: RatingBaseDto, response: Response, db: Session = Depends(get_db)):
-    new_rating = create_or_rollback(Rating, rating.model_dump(), db)
+async def create_rating(rating: RatingBaseDto, response: Response, db: AsyncSession = Depends(get_async_db)):
+    new_rating = await create_or_rollback(Rating, rating.model_dump(), db)
+    await run_model_update(recommender.apply_rating, new_rating.user_id, new_rating.movie_id, new_rating.rating)
     response.headers["Location"] = f"/ratings/{new_rating.id}"
     return RatingDto.model_validate(new_rating)
 
 @router.patch("/{rating_id}", response_model=RatingDto)
-async def update_rating(rating_id: int, updated_rating: RatingBaseDto, db: Session = Depends(get_db)):
-    rating = get_entity(Rating, rating_id, db)
+async def update_rating(rating_id: int, updated_rating: RatingBaseDto, db: AsyncSession = Depends(get_async_db)):
+    rating = await get_entity(Rating, rating_id, db)
+    old_user_id, old_movie_id = rating.user_id, rating.movie_id
     updates = updated_rating.model_dump(exclude_none=True)
-    updated_rating_final = update_or_rollback(rating, updates, db)
+    updated_rating_final = await update_or_rollback(rating, updates, db)
+    changes = [(updated_rating_final.user_id, updated_rating_final.movie_id, updated_rating_final.rating)]
+    if (old_user_id, old_movie_id) != (updated_rating_final.user_id, updated_rating_final.movie_id):
+        changes.insert(0, (old_user_id, old_movie_id, None))
+    await run_model_update(recommender.apply_changes, changes)
     return RatingDto.model_validate(updated_rating_final)
 
 @router.delete("/{rating_id}", response_model=RatingDto)
-async def delete_rating(rating_id: int, db: Session = Depends(get_db)):
-    rating = get_entity(Rating, rating_id, db)
-    delete_or_rollback(rating,db)
+async def delete_rating(rating_id: int, db: AsyncSession = Depends(get_async_db)):
+    rating = await get_entity(Rating, rating_id, db)
+    user_id, movie_id = rating.user_id, rating.movie_id
+    await delete_or_rollback(rating,db)
+    await run_model_update(recommender.remove_rating, user_id, movie_id)
     return {"message": f"Rating with ID {rating_id} has been deleted"}
\ No newline at end of file
@@ -0,0 +1,99 @@
+import time
+from datetime import datetime
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from algorithm import recommender
+from algorithm.scheduler import scheduler
+from dtos.dtos import RecommenderStatusDto, RecommendationBatchDto, UserRecommendationsDto
+from helpers.compute_helpers import run_in_pool, wait_in_pool
+
+# Users per vectorized pass of the streaming export
+STREAM_CHUNK_SIZE = 1000
+
+router = APIRouter(
+    prefix="/recommendations",
+    tags=["recommendations"],
+)
+
+@router.get("/status", response_model=RecommenderStatusDto)
+async def read_status():
+    """
+    Get the version, build duration and age of the recommender model, to alert on staleness,
+    and the counters of the recommendation result cache and the feed queues.
+    """
+    cache = recommender.result_cache
+    status = RecommenderStatusDto(
+        dirty_ratings=recommender.dirty_ratings(),
+        rebuilding=scheduler.rebuilding,
+        last_error=scheduler.last_error,
+        cache_size=len(cache),
+        cache_hits=cache.hits,
+        cache_misses=cache.misses,
+        cache_evictions=cache.evictions,
+        cache_invalidations=cache.invalidations,
+        feed_queues=len(recommender.feed_queues),
+        feed_refills=recommender.feed_queues.refills,
+        feed_evictions=recommender.feed_queues.evictions,
+    )
+    model = recommender.current_model()
+    if model is not None:
+        status.version = model.version
+        status.built_at = datetime.fromtimestamp(model.built_at)
+        status.build_duration = model.build_duration
+        status.age = time.time() - model.built_at
+    return status
+
+@router.post("/rebuild", status_code=202)
+async def rebuild():
+    """
+    Rebuild the recommender model in the background.
+    """
+    scheduler.request_rebuild()
+    return {"message": "Recommender model rebuild requested"}
+
+@router.post("/batch", response_model=list[UserRecommendationsDto])
+async def recommend_batch(batch: RecommendationBatchDto):
+    """
+    Get movie recommendations for many users at once, computed in vectorized passes.
+    """
+    recommendations = await run_in_pool(
+        lambda: recommender.get_model().recommend_movies_batch(batch.user_ids, k=batch.k, top_n=batch.top_n)
+    )
+    return [UserRecommendationsDto(user_id=user_id, movies=movies)
+            for user_id, movies in zip(batch.user_ids, recommendations)]
+
+@router.get("/all")
+async def recommend_all(k: int = Query(default=5, ge=1, le=100), top_n: int = Query(default=5, ge=1, le=100)):
+    """
+    Stream the movie recommendations of every user with ratings, as one JSON object per line.
+    The first chunk is computed before the response starts, so a busy compute pool is reported
+    with a 503.
+    """
+    model, user_ids = await run_in_pool(all_user_ids)
+    first_chunk = await run_in_pool(model.recommend_movies_batch, user_ids[:STREAM_CHUNK_SIZE], k, top_n)
+    return StreamingResponse(generate_all_recommendations(model, user_ids, first_chunk, k, top_n),
+                             media_type="application/x-ndjson")
+
+def all_user_ids():
+    """
+    Returns the shared model and the ids of all users with ratings in it.
+    """
+    model = recommender.get_model()
+    with model.lock:
+        return model, model.matrix.user_ids.tolist()
+
+async def generate_all_recommendations(model, user_ids, first_chunk, k, top_n):
+    """
+    Computes the recommendations chunk by chunk on the compute pool while they are streamed,
+    so only one chunk is held in memory and the event loop isn't blocked. The later chunks
+    wait for a free slot of the pool, because the response has already started.
+    """
+    recommendations = first_chunk
+    for start in range(0, len(user_ids), STREAM_CHUNK_SIZE):
+        chunk = user_ids[start:start + STREAM_CHUNK_SIZE]
+        if start:
+            recommendations = await wait_in_pool(model.recommend_movies_batch, chunk, k, top_n)
+        for user_id, movies in zip(chunk, recommendations):
+            yield UserRecommendationsDto(user_id=user_id, movies=movies).model_dump_json() + "\n"
@@ -1,18 +1,20 @@
-from fastapi import APIRouter, HTTPException, Response
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Response, Query
 from fastapi.params import Depends
-from sqlalchemy.orm import Session
-
-from database import get_db
-from dtos.dtos import UserDto, UserBaseDto, MovieDto
-from dtos.dtos import UserDto, UserBaseDto
-from helpers.database_helpers import delete_or_rollback, get_all_entities, get_entity, create_or_rollback, \
-    update_or_rollback
-from dtos.dtos import UserDto, UserBaseDto
-from models.base import User
-
-from algorithm.algorithm import (
-    recommend_movies, load_data_from_db, build_user_item_matrix, cosine_similarity_matrix
-)
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from dtos.dtos import UserDto, UserBaseDto, MovieDto, NeighbourDto, RecommendedMovieDto, RatingDto, RatingUpsertDto
+from algorithm.feed import FEED_QUEUE_DEPTH
+from helpers.compute_helpers import run_in_pool, submit_to_pool, run_model_update
+from helpers.database_helpers import delete_or_rollback, get_entity, create_or_rollback, update_or_rollback, \
+    get_page_of_entities, set_next_cursor, upsert_entity, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models.base import User, Movie, Rating
+
+from algorithm import recommender
 
 router = APIRouter(
     prefix="/users",
@@ -20,44 +22,129 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=list[UserDto])
-async def read_users(db: Session = Depends(get_db)):
-    users = get_all_entities(User, db)
+async def read_users(response: Response,
+                     limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     after_id: Optional[int] = Query(default=None, description="ID of the last user of the previous page"),
+                     db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of users, ordered by ID. The X-Next-Cursor response header holds the after_id
+    of the next page.
+    """
+    users = await get_page_of_entities(User, db, limit, after_id)
+    set_next_cursor(response, users, limit)
     return [UserDto.model_validate(user) for user in users]
 
 @router.get("/{user_id}", response_model=UserDto)
-async def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = get_entity(User, user_id, db)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await get_entity(User, user_id, db)
     return UserDto.model_validate(user)
 
 @router.post("/")
-async def create_user(user: UserBaseDto, response: Response, db: Session = Depends(get_db)):
-    new_user = create_or_rollback(User, user.model_dump(), db)
+async def create_user(user: UserBaseDto, response: Response, db: AsyncSession = Depends(get_async_db)):
+    new_user = await create_or_rollback(User, user.model_dump(), db)
     response.headers["Location"] = f"/ratings/{new_user.id}"
     return UserDto.model_validate(new_user)
 
 @router.patch("/{user_id}", response_model=UserDto)
-async def update_user(user_id: int, updated_user: UserBaseDto, db: Session = Depends(get_db)):
-    user = get_entity(User, user_id, db)
+async def update_user(user_id: int, updated_user: UserBaseDto, db: AsyncSession = Depends(get_async_db)):
+    user = await get_entity(User, user_id, db)
     updates = updated_user.model_dump(exclude_none=True)
-    updated_user_final = update_or_rollback(user, updates, db)
+    updated_user_final = await update_or_rollback(user, updates, db)
     return UserDto.model_validate(updated_user_final)
 
 @router.delete("/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = get_entity(User,user_id, db)
-    delete_or_rollback(user,db)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await get_entity(User,user_id, db)
+    await delete_or_rollback(user,db)
+    await run_model_update(recommender.remove_user, user_id)
     return {"message": f"User with ID {user_id} has been deleted"}
 
-@router.get("/{user_id}/recommend")
-async def get_user_recommendations(user_id: int):
+@router.get("/{user_id}/ratings", response_model=list[RatingDto])
+async def read_user_ratings(user_id: int, response: Response,
+                            limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                            after_id: Optional[int] = Query(default=None, description="ID of the last rating of the previous page"),
+                            db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of the ratings of a user, ordered by ID. The X-Next-Cursor response header holds
+    the after_id of the next page.
+    """
+    await get_entity(User, user_id, db)
+    ratings = await get_page_of_entities(Rating, db, limit, after_id, user_id=user_id)
+    set_next_cursor(response, ratings, limit)
+    return [RatingDto.model_validate(rating) for rating in ratings]
+
+@router.get("/{user_id}/unseen-movies", response_model=list[MovieDto])
+async def read_unseen_movies(user_id: int, response: Response,
+                             limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             after_id: Optional[int] = Query(default=None, description="ID of the last movie of the previous page"),
+                             genre_id: Optional[int] = Query(default=None, description="Only movies of this genre"),
+                             db: AsyncSession = Depends(get_async_db)):
+    """
+    Get a page of the movies a user hasn't rated yet, ordered by ID. The X-Next-Cursor response
+    header holds the after_id of the next page.
+    The movies are walked in ID order and every movie is checked against the (user_id, movie_id)
+    index of the ratings, so a page only reads the movies up to the end of the page.
+    """
+    await get_entity(User, user_id, db)
+    rated = select(Rating.id).where(Rating.user_id == user_id, Rating.movie_id == Movie.id)
+    movies = await get_page_of_entities(Movie, db, limit, after_id, conditions=(~rated.exists(),), genre_id=genre_id)
+    set_next_cursor(response, movies, limit)
+    return [MovieDto.model_validate(movie) for movie in movies]
+
+@router.put("/{user_id}/ratings/{movie_id}", response_model=RatingDto)
+async def put_user_rating(user_id: int, movie_id: int, rating: RatingUpsertDto, db: AsyncSession = Depends(get_async_db)):
+    """
+    Rate a movie, or change the rating if the user already rated it, in a single statement.
+    """
+    await get_entity(User, user_id, db)
+    await get_entity(Movie, movie_id, db)
+    rating_data = {"user_id": user_id, "movie_id": movie_id, "rating": rating.rating,
+                   "date": rating.date or date.today()}
+    upserted_rating = await upsert_entity(Rating, rating_data, ["user_id", "movie_id"], db)
+    await run_model_update(recommender.apply_rating, user_id, movie_id, upserted_rating.rating)
+    return RatingDto.model_validate(upserted_rating)
+
+@router.get("/{user_id}/recommend", response_model=list[RecommendedMovieDto])
+async def get_user_recommendations(user_id: int,
+                                   k: int = Query(default=5, ge=1, le=100),
+                                   top_n: int = Query(default=5, ge=1, le=100),
+                                   genre_id: Optional[list[int]] = Query(default=None),
+                                   exclude: Optional[list[int]] = Query(default=None)):
     """
-    Get movie recommendations for a user.
+    Get movie recommendations for a user, served from the shared in-memory model, with the
+    details of every movie so no follow-up requests are needed.
+    Cached recommendations are returned right away, others are computed on the compute pool,
+    so they don't block other requests.
+    :param k: Number of similar users to predict from.
+    :param top_n: Number of movies to recommend.
+    :param genre_id: Only recommend movies of these genres.
+    :param exclude: Movie ids that must not be recommended, e.g. the ones already shown.
     """
-    ratings_data, movies_data = load_data_from_db()
+    recommended_movies = recommender.cached_recommendations(user_id, k, top_n, genre_id, exclude)
+    if recommended_movies is None:
+        recommended_movies = await run_in_pool(recommender.recommend, user_id, k, top_n, genre_id, exclude)
+    return [RecommendedMovieDto(**movie) for movie in recommended_movies]
 
-    user_item_matrix = build_user_item_matrix(ratings_data)
-    similarity_matrix = cosine_similarity_matrix(user_item_matrix)
-    recommended_movies = recommend_movies(
-        user_id, user_item_matrix, similarity_matrix, movies_data, k=5, top_n=5
-    )
-    return recommended_movies
\ No newline at end of file
+@router.get("/{user_id}/feed", response_model=list[RecommendedMovieDto])
+async def get_user_feed(user_id: int, n: int = Query(default=10, ge=1, le=FEED_QUEUE_DEPTH)):
+    """
+    Get the next cards of a user's swipe feed, best first, from the user's precomputed queue of
+    ranked candidates. Rating a movie removes it from the queue, and the queue is refilled in
+    the background when it runs low, so serving the feed doesn't compute recommendations.
+    Only the first request of a user waits for the queue to be filled.
+    :param n: Number of cards to return.
+    """
+    cards = recommender.feed_queues.peek(user_id, n)
+    if cards is None:
+        cards = await run_in_pool(recommender.feed, user_id, n)
+    elif recommender.feed_queues.needs_refill(user_id):
+        submit_to_pool(recommender.refill_feed, user_id)
+    return [RecommendedMovieDto(**card) for card in cards]
+
+@router.get("/{user_id}/neighbours", response_model=list[NeighbourDto])
+async def get_user_neighbours(user_id: int, k: int = Query(default=5, ge=1, le=100)):
+    """
+    Get the users most similar to a user, as used for the recommendations.
+    """
+    neighbours = await run_in_pool(lambda: recommender.get_model().neighbours(user_id, k))
+    return [NeighbourDto(user_id=neighbour_id, similarity=similarity) for neighbour_id, similarity in neighbours]
@@ -1,7 +1,19 @@
+from datetime import date
+
+import numpy as np
 import pandas as pd
 from algorithm.algorithm import (
-    build_user_item_matrix, cosine_similarity_matrix, recommend_movies
+    build_user_item_matrix, cosine_similarity_matrix, recommend_movies, predict_rating
 )
+from algorithm.features import MovieFeatures
+from algorithm.scoring import user_preferences, score_candidates, NO_GENRE
+from algorithm.model import RecommenderModel
+from algorithm.sparse import RatingMatrix
+from algorithm.lsh import LshNeighbourIndex
+from algorithm.profiles import UserProfiles
+from algorithm.cache import RecommendationCache
+from algorithm.feed import FeedQueues
+from algorithm.snapshot import save_snapshot, load_snapshot, latest_snapshot
 
 # Mock data
 ratings_data = pd.DataFrame({
@@ -13,11 +25,22 @@ ratings_data = pd.DataFrame({
 movies_data = pd.DataFrame({
     'movie_id': [1, 2, 3],
     'title': ['Movie 1', 'Movie 2', 'Movie 3'],
-    'genre': ['Action', 'Comedy', 'Drama'],
+    'genre': [1, 2, 3],
     'runtime': [120, 90, 150],
     'release_date': ['2000-01-01', '2005-01-01', '2010-07-15']
 })
 
+def assert_same_neighbours(model, other):
+    """
+    Asserts that two models find the same neighbours with the same similarities for every user,
+    which works for every neighbour backend.
+    """
+    assert sorted(model.user_index) == sorted(other.user_index)
+    for user_id in model.user_index:
+        neighbours, other_neighbours = model.neighbours(user_id, k=10), other.neighbours(user_id, k=10)
+        assert [neighbour_id for neighbour_id, _ in neighbours] == [neighbour_id for neighbour_id, _ in other_neighbours]
+        assert np.allclose([similarity for _, similarity in neighbours], [similarity for _, similarity in other_neighbours])
+
 def test_build_user_item_matrix():
     user_item_matrix = build_user_item_matrix(ratings_data)
     assert user_item_matrix.shape == (3, 3)
@@ -31,6 +54,22 @@ def test_cosine_similarity_matrix():
     assert similarity_matrix[0, 1] > 0
 
 
+def test_rating_matrix_cosine_similarity_matches_dense():
+    matrix = RatingMatrix.from_ratings(ratings_data['user_id'], ratings_data['movie_id'], ratings_data['rating'])
+    dense_similarity = cosine_similarity_matrix(build_user_item_matrix(ratings_data))
+
+    assert matrix.shape == (3, 3)
+    assert matrix.get(matrix.user_index[1], matrix.movie_index[1]) == 5
+    assert np.isnan(matrix.get(matrix.user_index[1], matrix.movie_index[3]))
+    assert np.allclose(matrix.cosine_similarity(), dense_similarity)
+
+def test_rating_matrix_keeps_last_duplicate_rating():
+    matrix = RatingMatrix.from_ratings([1, 1, 2], [1, 1, 1], [2, 4, 3])
+
+    assert matrix.nnz == 2
+    assert matrix.get(matrix.user_index[1], matrix.movie_index[1]) == 4
+
+
 def test_recommend_movies():
     user_item_matrix = build_user_item_matrix(ratings_data)
     similarity_matrix = cosine_similarity_matrix(user_item_matrix)
@@ -38,3 +77,215 @@ def test_recommend_movies():
 
     assert len(recommendations) == 1
     assert recommendations[0] in ['Movie 3']
+
+def test_score_candidates_matches_predict_rating():
+    user_item_matrix = build_user_item_matrix(ratings_data)
+    similarity_matrix = cosine_similarity_matrix(user_item_matrix)
+    features = MovieFeatures.from_dataframe(movies_data)
+    user_id = 3
+    candidates = user_item_matrix.columns
+    neighbours = np.argsort(similarity_matrix[2])[-2:]
+
+    user_ratings = user_item_matrix.loc[user_id].dropna()
+    preferences = user_preferences(user_ratings.to_numpy(),
+                                   *features.scoring_features(features.rows(user_ratings.index)))
+    scores = score_candidates(user_item_matrix.iloc[neighbours].to_numpy(), similarity_matrix[2, neighbours],
+                              *features.scoring_features(features.rows(candidates)), preferences)
+
+    for movie_id, score in zip(candidates, scores):
+        expected = predict_rating(user_id, movie_id, similarity_matrix, user_item_matrix, movies_data, k=2)
+        if expected is None:
+            assert np.isnan(score)
+        else:
+            assert np.isclose(score, expected)
+
+def test_recommender_model_recommend():
+    model = RecommenderModel.build(ratings_data, movies_data)
+
+    assert model.recommend(1, k=2, top_n=2) == ['Movie 3']
+    assert model.recommend(42, k=2, top_n=2) == []
+
+def test_recommender_model_apply_rating_matches_rebuild():
+    model = RecommenderModel.build(ratings_data, movies_data)
+    model.apply_rating(1, 3, 2)
+    model.apply_rating(4, 1, 5)
+    model.remove_rating(2, 1)
+
+    updated_ratings = pd.DataFrame({
+        'user_id': [1, 1, 1, 2, 3, 3, 4],
+        'movie_id': [1, 2, 3, 3, 2, 3, 1],
+        'rating': [5, 4, 2, 5, 3, 2, 5]
+    })
+    rebuilt = RecommenderModel.build(updated_ratings, movies_data)
+
+    assert_same_neighbours(model, rebuilt)
+    assert np.allclose(model.norms[[model.user_index[user_id] for user_id in rebuilt.user_index]], rebuilt.norms)
+
+def test_recommender_model_movie_and_user_changes_match_rebuild():
+    model = RecommenderModel.build(ratings_data, movies_data)
+    model.update_movie(3, 'Movie 3 (Extended)', date(2010, 7, 15), 170, 2)
+    model.remove_movie(2)
+    model.remove_user(3)
+
+    rebuilt = RecommenderModel.build(ratings_data[ratings_data['movie_id'] != 2],
+                                     movies_data[movies_data['movie_id'] != 2].replace('Movie 3', 'Movie 3 (Extended)'))
+
+    assert model.recommend(1, k=2, top_n=3) == ['Movie 3 (Extended)']
+    assert model.recommend_movies(1, k=2, top_n=3)[0]["runtime"] == 170
+    # The deleted movie's ratings are gone, and the deleted user is nobody's neighbour anymore
+    assert [user_id for user_id, _ in model.neighbours(1, k=1)] == [2]
+    assert np.isclose(model.neighbours(1, k=1)[0][1], rebuilt.neighbours(1, k=1)[0][1])
+    # User 2 liked movies 1 and 3, whose new runtime is part of the profile
+    assert model.profiles.preferred_runtimes[model.user_index[2]] == (120 + 170) / 2
+
+def test_recommender_model_neighbours_follow_rating_changes():
+    model = RecommenderModel.build(ratings_data, movies_data)
+    assert [user_id for user_id, _ in model.neighbours(3, k=2)] == [1, 2]
+
+    model.apply_rating(2, 2, 5)
+
+    assert [user_id for user_id, _ in model.neighbours(3, k=2)] == [2, 1]
+
+def test_lsh_neighbour_index_finds_identical_users():
+    matrix = RatingMatrix.from_ratings([1, 1, 2, 2, 3, 3, 4], [1, 2, 1, 2, 3, 4, 4], [5, 1, 5, 1, 4, 4, 2])
+    lsh = LshNeighbourIndex(matrix, matrix.row_norms(), tables=4, bits=2)
+
+    indexes, similarities = lsh.neighbours(matrix.user_index[1], k=1)
+    assert matrix.user_ids[indexes].tolist() == [2]
+    assert np.isclose(similarities[0], 1)
+
+    # After user 4 copies user 3's ratings it is hashed into the same buckets
+    matrix.set(matrix.user_index[4], matrix.movie_index[3], 4)
+    matrix.set(matrix.user_index[4], matrix.movie_index[4], 4)
+    lsh.update_user(matrix, matrix.row_norms(), matrix.user_index[4])
+    indexes, similarities = lsh.neighbours(matrix.user_index[3], k=1)
+    assert matrix.user_ids[indexes].tolist() == [4]
+    assert np.isclose(similarities[0], 1)
+
+def test_user_profiles_match_user_preferences():
+    model = RecommenderModel.build(ratings_data, movies_data)
+    model.apply_rating(3, 1, 5)
+    rebuilt = UserProfiles.build(model.matrix, *model.features.scoring_features(model.column_rows))
+
+    for user_id, user_index in model.user_index.items():
+        columns, ratings = model.matrix.row(user_index)
+        expected = user_preferences(ratings, *model.features.scoring_features(model.column_rows[columns]))
+        assert np.allclose(model.profiles.preferences(user_index), expected)
+        assert np.allclose(rebuilt.preferences(user_index), expected)
+    assert model.profiles.liked_counts.tolist() == [2, 2, 1]
+
+def test_movie_features_lookups():
+    features = MovieFeatures.from_dataframe(movies_data)
+
+    rows = features.rows([3, 1, 42])
+    assert rows.tolist() == [2, 0, -1]
+    assert features.titles[rows[:2]].tolist() == ['Movie 3', 'Movie 1']
+    assert features.release_years.dtype == np.int16 and features.runtimes.dtype == np.int16
+
+    runtimes, release_years, genres = features.scoring_features(rows)
+    assert runtimes[:2].tolist() == [150, 120] and np.isnan(runtimes[2])
+    assert release_years[:2].tolist() == [2010, 2000] and np.isnan(release_years[2])
+    assert genres.tolist() == [3, 1, -1]
+
+    # Genre ids are stored as they are, missing genres as NO_GENRE
+    features = MovieFeatures.from_dataframe(movies_data.assign(genre=[7, None, 3]))
+    assert features.genres.tolist() == [7, NO_GENRE, 3]
+    assert [movie["genre_id"] for movie in features.describe([0, 1])] == [7, None]
+
+def test_model_snapshot_round_trip(tmp_path):
+    model = RecommenderModel.build(ratings_data, movies_data)
+    model.version = 1
+    save_snapshot(model, str(tmp_path))
+    model.version = 2
+    save_snapshot(model, str(tmp_path), keep=1)
+
+    path = latest_snapshot(str(tmp_path))
+    assert path == str(tmp_path / "2")
+    assert not (tmp_path / "1").exists()
+
+    loaded = load_snapshot(path)
+    assert loaded.version == 2
+    assert all(isinstance(array, np.memmap) for array in loaded.neighbour_index.to_arrays().values())
+    assert loaded.recommend(3, k=2, top_n=3) == model.recommend(3, k=2, top_n=3)
+    assert loaded.neighbours(1, k=2) == model.neighbours(1, k=2)
+
+    # Updates are copy-on-write and leave the snapshot files untouched
+    loaded.apply_rating(3, 1, 5)
+    model.apply_rating(3, 1, 5)
+    assert_same_neighbours(loaded, model)
+    assert load_snapshot(path).neighbours(3, k=2) != loaded.neighbours(3, k=2)
+
+def test_lsh_model_snapshot_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr("algorithm.neighbours.NEIGHBOUR_BACKEND", "lsh")
+    model = RecommenderModel.build(ratings_data, movies_data)
+    loaded = load_snapshot(save_snapshot(model, str(tmp_path)))
+
+    assert isinstance(loaded.neighbour_index, LshNeighbourIndex)
+    assert loaded.neighbours(1, k=2) == model.neighbours(1, k=2)
+    assert loaded.recommend(3, k=2, top_n=3) == model.recommend(3, k=2, top_n=3)
+
+    # Movies added after the restore are hashed the same as in a model that was built with them
+    loaded.apply_rating(1, 4, 5)
+    model.apply_rating(1, 4, 5)
+    assert np.array_equal(loaded.neighbour_index.to_arrays()["planes"], model.neighbour_index.to_arrays()["planes"])
+    assert_same_neighbours(loaded, model)
+
+def test_recommendation_cache_evicts_and_invalidates():
+    cache = RecommendationCache(max_size=2, ttl=0)
+    cache.put(1, 5, 5, 1, ['Movie 1'])
+    cache.put(2, 5, 5, 1, ['Movie 2'])
+    assert cache.get(1, 5, 5, 1) == ['Movie 1']
+    assert cache.get(1, 5, 5, 2) is None
+
+    # User 2 is the least recently used
+    cache.put(3, 5, 5, 1, ['Movie 3'])
+    assert cache.get(2, 5, 5, 1) is None
+    assert cache.evictions == 1
+
+    generation = cache.generation
+    cache.invalidate_users([1])
+    assert cache.get(1, 5, 5, 1) is None
+    assert cache.invalidations == 1
+    # Computed before the invalidation, so possibly outdated
+    cache.put(1, 5, 5, 1, ['Movie 1'], generation)
+    assert cache.get(1, 5, 5, 1) is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+def test_feed_queues_consume_refill_and_evict():
+    feed = FeedQueues(depth=3, refill_threshold=2, max_users=2)
+    assert feed.peek(1, 2) is None
+    assert feed.needs_refill(1)
+
+    assert feed.start_refill(1)
+    assert not feed.start_refill(1)
+    feed.finish_refill(1, [{"id": movie_id} for movie_id in [10, 11, 12, 13]])
+    assert feed.peek(1, 5) == [{"id": 10}, {"id": 11}, {"id": 12}]
+    assert not feed.needs_refill(1)
+
+    # Rated movies are consumed, and a refill is needed below the threshold
+    feed.consume(1, [10, 11])
+    assert feed.peek(1, 2) == [{"id": 12}]
+    assert feed.needs_refill(1)
+
+    # Movies rated while the refill is running are left out of its result
+    feed.start_refill(1)
+    feed.consume(1, [12])
+    feed.finish_refill(1, [{"id": 12}, {"id": 13}])
+    assert feed.peek(1, 2) == [{"id": 13}]
+    assert not feed.needs_refill(1)
+
+    # User 1 is the least recently used
+    feed.start_refill(2)
+    feed.peek(2, 1)
+    feed.start_refill(3)
+    assert feed.peek(1, 1) is None
+    assert (len(feed), feed.evictions, feed.refills) == (2, 1, 2)
+
+def test_recommender_model_reports_users_affected_by_rating_changes():
+    model = RecommenderModel.build(ratings_data, movies_data)
+    for user_id in model.user_index:
+        model.neighbours(user_id, k=2)
+
+    # Every user has the others as neighbours, so all their recommendations may change
+    assert sorted(model.apply_rating(3, 1, 5)) == [1, 2, 3]
+    assert model.tracks_changes(2)
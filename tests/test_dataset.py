@@ -0,0 +1,75 @@
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import delete, func, select
+
+from database import get_db
+from dataset.bulk import bulk_insert
+from dataset.movies import read_movie_chunks, read_movies, insert_movies
+from dataset.ratings import generate_random_ratings
+from models.base import User, Rating, Movie, Genre, MovieGenre
+from tests.test_database_integration import fill_db, drop_tables
+
+
+def test_bulk_insert_skips_conflicts(db = next(get_db())):
+    fill_db(db)
+
+    users = [{"username": f"bulk{i}", "first_name": "Bulk", "last_name": "User"} for i in range(7)]
+    users.append({"username": "user1", "first_name": "John", "last_name": "Doe"})
+    assert bulk_insert(db, User, users, batch_size=3, ignore_conflicts=True) == 7
+    assert db.scalar(select(func.count()).select_from(User)) == 10
+
+    # Inserting the same users again adds nothing
+    assert bulk_insert(db, User, iter(users), batch_size=3, ignore_conflicts=True) == 0
+
+    drop_tables()
+
+def test_bulk_insert_ratings(db = next(get_db())):
+    fill_db(db)
+
+    # Every user and movie pair can only be rated once, so start without ratings
+    db.execute(delete(Rating))
+    db.commit()
+
+    ratings = generate_random_ratings([1, 2, 3], [1, 2], count=6)
+    assert bulk_insert(db, Rating, ratings, batch_size=4) == 6
+    assert db.scalar(select(func.count()).select_from(Rating)) == 6
+
+    drop_tables()
+
+FIXTURE_CSV = "tests/fixtures/tmdb_movies.csv"
+
+def test_read_movie_chunks_validates_rows():
+    chunks = list(read_movie_chunks(FIXTURE_CSV, chunk_size=4))
+    assert len(chunks) == 3
+
+    movies = pd.concat(chunks)
+    assert movies["title"].tolist() == ["Gladiator", "The Dark Knight", "Inception", "Gladiator Again", "Amélie"]
+    assert movies["genres"].tolist() == [["Action", "Drama", "Adventure"], ["Drama", "Action", "Crime"],
+                                         ["Action", "Science Fiction"], ["Action"], ["Comedy", "Romance"]]
+    assert movies["runtime"].tolist() == [155, 152, 148, 155, 122]
+    assert movies["release_date"].iloc[0] == date(2000, 5, 1)
+
+def test_insert_movies_with_genres(db = next(get_db())):
+    fill_db(db)
+
+    assert insert_movies(db, read_movies(FIXTURE_CSV, chunk_size=4), batch_size=2) == 4
+    titles = db.scalars(select(Movie.title).where(Movie.id > 2).order_by(Movie.id)).all()
+    assert titles == ["Gladiator", "The Dark Knight", "Inception", "Amélie"]
+
+    # The existing genre is reused, and every other genre is created once
+    genre_names = db.scalars(select(Genre.name).order_by(Genre.id)).all()
+    assert genre_names == ["Comedy", "Action", "Drama", "Adventure", "Crime", "Science Fiction", "Romance"]
+
+    gladiator_genres = db.scalars(select(Genre.name).join(MovieGenre).join(Movie, Movie.id == MovieGenre.movie_id)
+                                  .where(Movie.title == "Gladiator").order_by(MovieGenre.position)).all()
+    assert gladiator_genres == ["Action", "Drama", "Adventure"]
+    assert db.scalar(select(Movie.genre_id).where(Movie.title == "Amélie")) == 1
+
+    # Importing the same file again adds nothing
+    assert insert_movies(db, read_movies(FIXTURE_CSV, chunk_size=4)) == 0
+    assert db.scalar(select(func.count()).select_from(MovieGenre)) == 10
+
+    assert sum(len(chunk) for chunk in read_movies(FIXTURE_CSV, max_movies=2, chunk_size=4)) == 2
+
+    drop_tables()
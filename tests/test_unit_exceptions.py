@@ -1,15 +1,30 @@
+import asyncio
+
 from fastapi import HTTPException
 from tests.test_database_integration import fill_db, drop_tables, create_tables
 import pytest
-from database import get_db
+from database import get_db, AsyncSessionLocal
 from helpers.database_helpers import get_entity, create_or_rollback, update_or_rollback, delete_or_rollback
 from datetime import datetime
 from sqlalchemy import text
 from models.base import Movie, Genre
 
-def activate_foreign_key(db=next(get_db())):
-    db.execute(text('PRAGMA foreign_keys = ON'))
-    db.commit()
+def run_async(function, foreign_keys=False):
+    """
+    Runs an async helper function with a new async session.
+    :param function: Function that takes the session and returns the coroutine to run.
+    """
+    async def run():
+        async with AsyncSessionLocal() as db:
+            if foreign_keys:
+                await db.execute(text('PRAGMA foreign_keys = ON'))
+            return await function(db)
+    return asyncio.run(run())
+
+def update_movie(movie_id, updates):
+    async def update(db):
+        return await update_or_rollback(await db.get(Movie, movie_id), updates, db)
+    return update
 
 def create_genre(db=next(get_db())):
     genre = Genre(name="Horror")
@@ -47,7 +62,7 @@ def test_get_entity_exception(db = next(get_db())):
 
     # Should give an exception. The database is filled with 2 movies, therefore entity_id 3 does not exist.
     with pytest.raises(HTTPException) as exc_info:
-        get_entity(Movie, 3, db)
+        run_async(lambda db: get_entity(Movie, 3, db))
 
     assert exc_info.value.status_code == 404
     assert exc_info.value.detail == "Entity not found"
@@ -55,14 +70,13 @@ def test_get_entity_exception(db = next(get_db())):
     drop_tables()
 
 def test_create_entity_foreign_key_exception(db=next(get_db())):
-    activate_foreign_key(db)
     fill_db(db)
 
     # Should give an exception. The database is filled with 1 genre, therefore genre_id 2 does not exist.
     movie_data = fill_movie(180, "aay27502", 2)
 
     with pytest.raises(HTTPException) as e:
-        create_or_rollback(Movie, movie_data, db)
+        run_async(lambda db: create_or_rollback(Movie, movie_data, db), foreign_keys=True)
 
     assert e.value.status_code == 400
     assert e.value.detail == "Invalid foreign key value"
@@ -76,7 +90,7 @@ def test_create_entity_db_constraint_exception(db=next(get_db())):
     movie_data = fill_movie(180, "tt1234567", 1)
 
     with pytest.raises(HTTPException) as e:
-        create_or_rollback(Movie, movie_data, db)
+        run_async(lambda db: create_or_rollback(Movie, movie_data, db))
 
     assert e.value.status_code == 400
     assert e.value.detail == "Database constraint error"
@@ -90,14 +104,13 @@ def test_create_entity_type_exception(db=next(get_db())):
     movie_data = fill_movie("string", "aay27502", 1)
 
     with pytest.raises(HTTPException) as e:
-        create_or_rollback(Movie, movie_data, db)
+        run_async(lambda db: create_or_rollback(Movie, movie_data, db))
 
     assert e.value.status_code == 400
     assert "Invalid type input" in e.value.detail
     drop_tables()
 
 def test_update_entity_foreign_key_exception(db = next(get_db())):
-    activate_foreign_key(db)
     create_tables()
     create_genre(db)
 
@@ -107,7 +120,7 @@ def test_update_entity_foreign_key_exception(db = next(get_db())):
     updated_movie = fill_upgrade(130, "tt1234567", 4)
 
     with pytest.raises(HTTPException) as e:
-        update_or_rollback(existing_movie, updated_movie, db)
+        run_async(update_movie(existing_movie.id, updated_movie), foreign_keys=True)
 
     assert e.value.status_code == 400
     assert e.value.detail == "Invalid foreign key value"
@@ -123,7 +136,7 @@ def test_update_entity_db_constraint_exception(db = next(get_db())):
     updated_movie = fill_upgrade(130, "tt1234567", 1)
 
     with pytest.raises(HTTPException) as e:
-        update_or_rollback(existing_movie, updated_movie, db)
+        run_async(update_movie(existing_movie.id, updated_movie))
 
     assert e.value.status_code == 400
     assert e.value.detail == "Database constraint error"
@@ -140,7 +153,7 @@ def test_update_entity_input_exception(db = next(get_db())):
     updated_movie = fill_upgrade("string", "tt1234567", 1)
 
     with pytest.raises(HTTPException) as e:
-        update_or_rollback(existing_movie, updated_movie, db)
+        run_async(update_movie(existing_movie.id, updated_movie))
 
     assert e.value.status_code == 400
     assert "Invalid type input" in e.value.detail
@@ -157,7 +170,7 @@ def test_update_entity_no_updates_exception(db = next(get_db())):
     updated_movie = {}
 
     with pytest.raises(HTTPException) as e:
-        update_or_rollback(existing_movie, updated_movie, db)
+        run_async(update_movie(existing_movie.id, updated_movie))
 
     assert e.value.status_code == 400
     assert e.value.detail == "No valid fields for update"
@@ -171,7 +184,7 @@ def test_delete_entity_exception(db = next(get_db())):
     existing_movie1 = None
 
     with pytest.raises(HTTPException) as e:
-        delete_or_rollback(existing_movie1, db)
+        run_async(lambda db: delete_or_rollback(existing_movie1, db))
 
     assert e.value.status_code == 400
     assert e.value.detail == "An error occurred while deleting"